@@ -1,30 +1,38 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort, jsonify, send_file
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-import qrcode
+import gc
 import os
 import uuid
+import weakref
 from datetime import datetime, date, timedelta
+from time import perf_counter
 from werkzeug.security import generate_password_hash, check_password_hash
-import requests
 import json
-import pandas as pd
-from io import BytesIO
+import itertools
+from collections import namedtuple
+from sqlalchemy.orm import make_transient_to_detached
+from metrics import REGISTRY, instrument_app, instrument_sqlalchemy
+from profiling import install_profiler
+from user_directory import UserDirectory
+from telemetry import (
+    METRICS as TELEMETRY_METRICS, TelemetryBatch, TelemetryError,
+    detect_excursions, downsample, parse_storage_conditions, summarize
+)
+# qrcode (which pulls in Pillow), requests and pandas are imported inside the
+# functions that use them, so importing this module stays cheap for web
+# workers, migrate_db.py and reconcile.py
 
-# Initialize Flask App
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///medical_tracking.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Blockchain server configuration
-BLOCKCHAIN_SERVER_URL = 'http://127.0.0.1:5000'
-
-# Initialize Extensions
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
+# Initialize Extensions; they are bound to an app in create_app()
+db = SQLAlchemy()
+login_manager = LoginManager()
 login_manager.login_view = 'login'
 
+BLOCKCHAIN_CALL_LATENCY = REGISTRY.histogram(
+    'blockchain_client_request_seconds', 'Latency of calls from the web app to the blockchain server',
+    ('operation', 'outcome')
+)
+
 MEDICINE_TYPES = [
     'Analgesics', 
     'Antibiotics', 
@@ -123,20 +131,65 @@ class Alert(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class TelemetryChunk(db.Model):
+    # One ingested batch of raw sensor readings, packed by telemetry.TelemetryBatch
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    start_time = db.Column(db.Float, nullable=False)
+    end_time = db.Column(db.Float, nullable=False)
+    reading_count = db.Column(db.Integer, nullable=False)
+    excursion_count = db.Column(db.Integer, default=0)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+class TelemetryAggregate(db.Model):
+    # Downsampled min/max/avg per product, metric and time bucket
+    __table_args__ = (db.UniqueConstraint('product_id', 'metric', 'interval', 'bucket_start'),)
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    metric = db.Column(db.String(20), nullable=False)
+    interval = db.Column(db.Integer, nullable=False)
+    bucket_start = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    minimum = db.Column(db.Float, nullable=False)
+    maximum = db.Column(db.Float, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+
+# Immutable copy of a User row, shared between requests by the user directory
+UserRecord = namedtuple('UserRecord', [column.name for column in User.__table__.columns])
+
+def user_record(user):
+    if user is None:
+        return None
+    return UserRecord(*(getattr(user, field) for field in UserRecord._fields))
+
+def get_user_directory():
+    """The current app's cache of users and role members"""
+    return current_app.extensions['user_directory']
+
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    record = get_user_directory().get(user_id)
+    if record is None:
+        return None
+    # Attach a per-request User built from the cached row, without a SELECT
+    user = User(**record._asdict())
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 # Helper Functions
 def generate_qr_code(batch_id):
+    import qrcode
+
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
         box_size=10,
         border=4,
     )
-    qr.add_data(f"{BLOCKCHAIN_SERVER_URL}/track/{batch_id}")
+    qr.add_data(f"{current_app.config['BLOCKCHAIN_SERVER_URL']}/track/{batch_id}")
     qr.make(fit=True)
     qr_code_path = os.path.join('static/qr_codes', f"{batch_id}.png")
     os.makedirs(os.path.dirname(qr_code_path), exist_ok=True)
@@ -175,8 +228,44 @@ def check_inventory_alerts():
         db.session.add(alert)
     db.session.commit()
 
+def merge_telemetry_aggregates(product_id, batch, interval):
+    """Fold a batch into the stored per-interval aggregates with one read per metric"""
+    for metric in TELEMETRY_METRICS:
+        buckets = downsample(batch.timestamps, batch.values(metric), interval)
+        if not buckets:
+            continue
+        existing = {
+            row.bucket_start: row
+            for row in TelemetryAggregate.query.filter(
+                TelemetryAggregate.product_id == product_id,
+                TelemetryAggregate.metric == metric,
+                TelemetryAggregate.interval == interval,
+                TelemetryAggregate.bucket_start.between(buckets[0].start, buckets[-1].start)
+            )
+        }
+        for bucket in buckets:
+            row = existing.get(bucket.start)
+            if row is None:
+                db.session.add(TelemetryAggregate(
+                    product_id=product_id,
+                    metric=metric,
+                    interval=interval,
+                    bucket_start=bucket.start,
+                    count=bucket.count,
+                    minimum=bucket.minimum,
+                    maximum=bucket.maximum,
+                    total=bucket.total
+                ))
+            else:
+                row.count += bucket.count
+                row.minimum = min(row.minimum, bucket.minimum)
+                row.maximum = max(row.maximum, bucket.maximum)
+                row.total += bucket.total
+
 # Blockchain integration helpers
 def add_to_blockchain(transaction_type, batch_id, product_data, status=None, updated_by=None):
+    import requests
+
     transaction = {
         'type': transaction_type,
         'batch_id': batch_id,
@@ -189,430 +278,739 @@ def add_to_blockchain(transaction_type, batch_id, product_data, status=None, upd
     if updated_by:
         transaction['updated_by'] = updated_by
 
+    start = perf_counter()
     try:
         response = requests.post(
-            f'{BLOCKCHAIN_SERVER_URL}/add_transaction',
+            f"{current_app.config['BLOCKCHAIN_SERVER_URL']}/add_transaction",
             json=transaction
         )
+        BLOCKCHAIN_CALL_LATENCY.observe(perf_counter() - start, operation='add_transaction',
+                                        outcome=str(response.status_code))
         return response.status_code == 200
     except requests.exceptions.RequestException:
+        BLOCKCHAIN_CALL_LATENCY.observe(perf_counter() - start, operation='add_transaction',
+                                        outcome='error')
         flash('Warning: Blockchain server is not accessible', 'warning')
         return False
 
+def blockchain_read(path, payload=None):
+    """Read from the next read replica, falling back to the leader if it is unreachable.
+
+    Read-only endpoints that take a request body (payload) are sent as POST.
+    """
+    import requests
+
+    def send(base_url):
+        if payload is None:
+            return requests.get(f'{base_url}{path}', timeout=5)
+        return requests.post(f'{base_url}{path}', json=payload, timeout=5)
+
+    leader = current_app.config['BLOCKCHAIN_SERVER_URL']
+    base_url = next(current_app.extensions['blockchain_read_urls'])
+    try:
+        return send(base_url)
+    except requests.exceptions.RequestException:
+        if base_url == leader:
+            raise
+        return send(leader)
+
 def get_product_history(batch_id):
+    import requests
+
+    start = perf_counter()
     try:
-        response = requests.get(f'{BLOCKCHAIN_SERVER_URL}/get_product_history/{batch_id}')
+        response = blockchain_read(f'/get_product_history/{batch_id}')
+        BLOCKCHAIN_CALL_LATENCY.observe(perf_counter() - start, operation='get_product_history',
+                                        outcome=str(response.status_code))
         if response.status_code == 200:
             return response.json()
     except requests.exceptions.RequestException:
+        BLOCKCHAIN_CALL_LATENCY.observe(perf_counter() - start, operation='get_product_history',
+                                        outcome='error')
         flash('Warning: Could not fetch blockchain history', 'warning')
     return []
 
-# Routes
-@app.route('/')
-def home():
-    return render_template('index.html')
-
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    if request.method == 'POST':
-        username = request.form['username']
-        email = request.form['email']
-        password = request.form['password']
-        role = request.form['role']
-        company_name = request.form.get('company_name')
-        address = request.form.get('address')
-        phone = request.form.get('phone')
-
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered!', 'danger')
-            return redirect(url_for('register'))
-
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-        new_user = User(
-            username=username,
-            email=email,
-            password=hashed_password,
-            role=role,
-            company_name=company_name,
-            address=address,
-            phone=phone
-        )
-        db.session.add(new_user)
-        db.session.commit()
+def get_batch_statuses(batch_ids):
+    """Chain confirmation for many batches in one call; None if the chain is unreachable"""
+    import requests
 
-        flash('Registration successful! Please login.', 'success')
-        return redirect(url_for('login'))
-    return render_template('register.html')
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        email = request.form['email']
-        password = request.form['password']
-        role = request.form['role']
-        user = User.query.filter_by(email=email, role=role).first()
-        
-        if user and check_password_hash(user.password, password):
-            login_user(user)
-            user.last_login = datetime.utcnow()
-            db.session.commit()
-            
-            if role == 'manufacturer':
-                return redirect(url_for('manufacturer'))
-            elif role == 'distributor':
-                return redirect(url_for('distributor'))
-            elif role == 'pharmacy':
-                return redirect(url_for('pharmacy'))
-        flash('Invalid credentials or role', 'danger')
-    return render_template('login.html')
-
-@app.route('/logout')
-@login_required
-def logout():
-    logout_user()
-    return redirect(url_for('home'))
-
-@app.route('/profile', methods=['GET', 'POST'])
-@login_required
-def profile():
-    if request.method == 'POST':
-        current_user.company_name = request.form.get('company_name')
-        current_user.address = request.form.get('address')
-        current_user.phone = request.form.get('phone')
-        
-        if 'current_password' in request.form and 'new_password' in request.form:
-            if check_password_hash(current_user.password, request.form['current_password']):
-                current_user.password = generate_password_hash(
-                    request.form['new_password'],
-                    method='pbkdf2:sha256'
-                )
-                flash('Password updated successfully!', 'success')
-            else:
-                flash('Current password is incorrect!', 'danger')
-        
-        db.session.commit()
-        flash('Profile updated successfully!', 'success')
-        return redirect(url_for('profile'))
-    
-    return render_template('profile.html')
+    start = perf_counter()
+    try:
+        response = blockchain_read('/batch_status', {'batch_ids': batch_ids})
+        BLOCKCHAIN_CALL_LATENCY.observe(perf_counter() - start, operation='batch_status',
+                                        outcome=str(response.status_code))
+        if response.status_code == 200:
+            return response.json()['batches']
+    except requests.exceptions.RequestException:
+        BLOCKCHAIN_CALL_LATENCY.observe(perf_counter() - start, operation='batch_status',
+                                        outcome='error')
+    return None
 
-@app.route('/manufacturer', methods=['GET', 'POST'])
-@login_required
-def manufacturer():
-    if current_user.role != 'manufacturer':
-        abort(403)
-    
-    # Get all distributors
-    distributors = User.query.filter_by(role='distributor').all()
-    
-    if request.method == 'POST':
-        name = request.form['name']
-        batch_id = str(uuid.uuid4())
-        product_id = request.form['product_id']
-        description = request.form['description']
-        medicine_type = request.form['medicine_type']
-        medicine_form = request.form['medicine_form']
-        expiration_date = datetime.strptime(request.form['expiration_date'], '%Y-%m-%d').date()
-        manufacturing_date = datetime.strptime(request.form['manufacturing_date'], '%Y-%m-%d').date()
-        dosage = request.form['dosage']
-        side_effects = request.form['side_effects']
-        storage_conditions = request.form.get('storage_conditions')
-        price = float(request.form.get('price', 0))
-        quantity = int(request.form.get('quantity', 0))
-        reorder_level = int(request.form.get('reorder_level', 10))
-        distributor_id = int(request.form['distributor_id'])  # New field
-        
-        qr_code_path = generate_qr_code(batch_id)
-        
-        product = Product(
-            name=name, 
-            batch_id=batch_id, 
-            qr_code_path=qr_code_path, 
-            manufacturer_id=current_user.id,
-            distributor_id=distributor_id,  # Add distributor_id
-            product_id=product_id,
-            description=description,
-            medicine_type=medicine_type,
-            medicine_form=medicine_form,
-            expiration_date=expiration_date,
-            manufacturing_date=manufacturing_date,
-            dosage=dosage,
-            side_effects=side_effects,
-            storage_conditions=storage_conditions,
-            price=price,
-            quantity=quantity,
-            reorder_level=reorder_level
-        )
-        db.session.add(product)
-        db.session.commit()
-        
-        # Add to blockchain
-        product_data = {
-            'name': name,
-            'product_id': product_id,
-            'manufacturer_id': current_user.id,
-            'distributor_id': distributor_id,  # Add distributor_id
-            'description': description,
-            'medicine_type': medicine_type,
-            'medicine_form': medicine_form,
-            'expiration_date': expiration_date.isoformat(),
-            'manufacturing_date': manufacturing_date.isoformat(),
-            'dosage': dosage,
-            'side_effects': side_effects,
-            'storage_conditions': storage_conditions,
-            'price': price,
-            'quantity': quantity,
-            'created_at': datetime.utcnow().isoformat()
-        }
-        add_to_blockchain('product_creation', batch_id, product_data)
-        
-        flash('Product added and QR code generated!', 'success')
-        return redirect(url_for('manufacturer'))
-    
-    products = Product.query.filter_by(manufacturer_id=current_user.id).all()
-    alerts = Alert.query.filter_by(user_id=current_user.id, is_read=False).all()
-    
-    # Get analytics data
-    total_products = len(products)
-    active_products = len([p for p in products if p.status == 'Active'])
-    low_stock_products = len([p for p in products if p.quantity <= p.reorder_level])
-    expiring_soon = len([p for p in products if p.expiration_date <= date.today() + timedelta(days=30)])
-    
-    return render_template(
-        'manufacturer.html',
-        products=products,
-        distributors=distributors,  # Pass distributors to template
-        medicine_types=MEDICINE_TYPES,
-        medicine_forms=MEDICINE_FORMS,
-        alerts=alerts,
-        analytics={
-            'total_products': total_products,
-            'active_products': active_products,
-            'low_stock': low_stock_products,
-            'expiring_soon': expiring_soon
-        }
+def chunked(items, size=500):
+    # Keeps IN lists under SQLite's bound-parameter limit
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def create_app(config=None):
+    """Build the web app.
+
+    Configuration comes from the environment and can be overridden with the
+    config mapping. Nothing here opens a connection or starts a thread, so
+    a pre-fork server can build the app once in its master process, for
+    example `gunicorn --preload -w 4 'app:create_app()'`.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'your_secret_key'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///medical_tracking.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TELEMETRY_INTERVAL'] = int(os.environ.get('TELEMETRY_INTERVAL', 300))  # Seconds per aggregate bucket
+    app.config['TELEMETRY_MAX_READINGS'] = int(os.environ.get('TELEMETRY_MAX_READINGS', 50000))  # Per request
+    app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))  # Seconds; 0 disables the cache
+
+    # Blockchain server configuration
+    app.config['BLOCKCHAIN_SERVER_URL'] = os.environ.get('BLOCKCHAIN_SERVER_URL', 'http://127.0.0.1:5000')
+    # Optional read replicas (comma separated) for history lookups; writes always go to the leader
+    app.config['BLOCKCHAIN_READ_URLS'] = [
+        url.strip().rstrip('/') for url in os.environ.get('BLOCKCHAIN_READ_URLS', '').split(',') if url.strip()
+    ]
+    if config:
+        app.config.update(config)
+    app.extensions['blockchain_read_urls'] = itertools.cycle(
+        app.config['BLOCKCHAIN_READ_URLS'] or [app.config['BLOCKCHAIN_SERVER_URL']]
     )
 
-@app.route('/distributor', methods=['GET', 'POST'])
-@login_required
-def distributor():
-    if current_user.role != 'distributor':
-        abort(403)
-    
-    # Get all pharmacies
-    pharmacies = User.query.filter_by(role='pharmacy').all()
-    
-    if request.method == 'POST':
-        product_id = request.form['product_id']
-        tracking_status = request.form['tracking_status']
-        current_location = request.form['current_location']
-        temperature = request.form.get('temperature')
-        humidity = request.form.get('humidity')
-        transport_conditions = request.form.get('transport_conditions')
-        expected_delivery_date = request.form.get('expected_delivery_date')
-        carrier = request.form.get('carrier')
-        tracking_number = request.form.get('tracking_number')
-        notes = request.form.get('notes')
-        pharmacy_id = int(request.form['pharmacy_id'])  # New field
-        
-        # Update product with pharmacy_id
-        product = Product.query.get(product_id)
-        if product:
-            product.pharmacy_id = pharmacy_id
-            
-            # Add tracking details
-            transport_tracking = TransportTracking(
-                product_id=product_id,
-                tracking_status=tracking_status,
-                current_location=current_location,
-                temperature=temperature,
-                humidity=humidity,
-                transport_conditions=transport_conditions,
-                expected_delivery_date=datetime.strptime(expected_delivery_date, '%Y-%m-%d') if expected_delivery_date else None,
-                carrier=carrier,
-                tracking_number=tracking_number,
-                notes=notes,
-                updated_by=current_user.id
+    db.init_app(app)
+    login_manager.init_app(app)
+    # Per app, so apps on different databases never share cached users
+    app.extensions['user_directory'] = UserDirectory(
+        load_user=lambda user_id: user_record(db.session.get(User, user_id)),
+        load_role=lambda role: tuple(user_record(user) for user in User.query.filter_by(role=role).order_by(User.id)),
+        ttl=app.config['USER_CACHE_TTL']
+    )
+
+    # Runtime metrics on /metrics and the opt-in request profiler
+    instrument_app(app)
+    instrument_sqlalchemy(app)
+    install_profiler(app)
+
+    register_routes(app)
+    prepare_for_fork(app)
+    return app
+
+# Apps whose inherited database pools a forked child must drop
+_fork_apps = weakref.WeakSet()
+_fork_hook_installed = False
+
+def _dispose_inherited_pools():
+    for app in list(_fork_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+def prepare_for_fork(app):
+    """Make processes forked from this one drop the app's inherited connection pools.
+
+    Otherwise a worker forked from a preloaded master could reuse the
+    master's database connections. One process-wide hook serves every app,
+    and apps that have been garbage collected are skipped.
+    """
+    global _fork_hook_installed
+    _fork_apps.add(app)
+    if _fork_hook_installed or not hasattr(os, 'register_at_fork'):
+        return
+    os.register_at_fork(after_in_child=_dispose_inherited_pools)
+    _fork_hook_installed = True
+
+def freeze_for_fork():
+    """Move every object allocated so far out of the garbage collector's reach.
+
+    Call it once in a pre-fork server's master, after the app is built, for
+    example from gunicorn's when_ready hook. A collection in a worker then
+    does not touch (and copy) pages it shares with the master. The objects
+    stay frozen in the calling process, so do not call it in a process that
+    relies on the collector to reclaim them.
+    """
+    gc.freeze()
+
+# Routes
+def register_routes(app):
+    @app.route('/')
+    def home():
+        return render_template('index.html')
+
+    @app.route('/register', methods=['GET', 'POST'])
+    def register():
+        if request.method == 'POST':
+            username = request.form['username']
+            email = request.form['email']
+            password = request.form['password']
+            role = request.form['role']
+            company_name = request.form.get('company_name')
+            address = request.form.get('address')
+            phone = request.form.get('phone')
+
+            if User.query.filter_by(email=email).first():
+                flash('Email already registered!', 'danger')
+                return redirect(url_for('register'))
+
+            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+            new_user = User(
+                username=username,
+                email=email,
+                password=hashed_password,
+                role=role,
+                company_name=company_name,
+                address=address,
+                phone=phone
             )
-            db.session.add(transport_tracking)
+            db.session.add(new_user)
             db.session.commit()
-            
-            # Add to blockchain
-            tracking_data = {
-                'product_id': product_id,
-                'pharmacy_id': pharmacy_id,  # Add pharmacy_id
-                'status': tracking_status,
-                'current_location': current_location,
-                'temperature': temperature,
-                'humidity': humidity,
-                'transport_conditions': transport_conditions,
-                'expected_delivery_date': expected_delivery_date,
-                'carrier': carrier,
-                'tracking_number': tracking_number,
-                'notes': notes
-            }
-            add_to_blockchain('status_update', product.batch_id, tracking_data, status=tracking_status, updated_by=current_user.id)
-            
-            flash('Product tracking updated successfully!', 'success')
-            return redirect(url_for('distributor'))
-    
-    products = Product.query.filter_by(distributor_id=current_user.id).all()
-    tracking_history = TransportTracking.query.all()
-    
-    # Get analytics data
-    total_shipments = len(tracking_history)
-    in_transit = len([t for t in tracking_history if t.tracking_status == 'In Transit'])
-    delivered = len([t for t in tracking_history if t.tracking_status == 'Delivered'])
-    delayed = len([t for t in tracking_history if t.expected_delivery_date and t.expected_delivery_date < date.today()])
-    
-    return render_template(
-        'distributor.html',
-        products=products,
-        pharmacies=pharmacies,  # Pass pharmacies to template
-        tracking_history=tracking_history,
-        analytics={
-            'total_shipments': total_shipments,
-            'in_transit': in_transit,
-            'delivered': delivered,
-            'delayed': delayed
-        }
-    )
+            get_user_directory().invalidate(new_user.id, role)
 
-@app.route('/pharmacy', methods=['GET', 'POST'])
-@login_required
-def pharmacy():
-    if current_user.role != 'pharmacy':
-        abort(403)
-    
-    if request.method == 'POST':
-        product_id = request.form['product_id']
-        status = request.form['status']
-        quantity = int(request.form.get('quantity', 0))
-        unit_price = float(request.form.get('unit_price', 0))
-        
-        product = Product.query.get(product_id)
-        if product:
-            inventory = PharmacyInventory(
+            flash('Registration successful! Please login.', 'success')
+            return redirect(url_for('login'))
+        return render_template('register.html')
+
+    @app.route('/login', methods=['GET', 'POST'])
+    def login():
+        if request.method == 'POST':
+            email = request.form['email']
+            password = request.form['password']
+            role = request.form['role']
+            user = User.query.filter_by(email=email, role=role).first()
+
+            if user and check_password_hash(user.password, password):
+                login_user(user)
+                user.last_login = datetime.utcnow()
+                db.session.commit()
+                get_user_directory().invalidate(user.id)
+
+                if role == 'manufacturer':
+                    return redirect(url_for('manufacturer'))
+                elif role == 'distributor':
+                    return redirect(url_for('distributor'))
+                elif role == 'pharmacy':
+                    return redirect(url_for('pharmacy'))
+            flash('Invalid credentials or role', 'danger')
+        return render_template('login.html')
+
+    @app.route('/logout')
+    @login_required
+    def logout():
+        logout_user()
+        return redirect(url_for('home'))
+
+    @app.route('/profile', methods=['GET', 'POST'])
+    @login_required
+    def profile():
+        if request.method == 'POST':
+            current_user.company_name = request.form.get('company_name')
+            current_user.address = request.form.get('address')
+            current_user.phone = request.form.get('phone')
+
+            if 'current_password' in request.form and 'new_password' in request.form:
+                if check_password_hash(current_user.password, request.form['current_password']):
+                    current_user.password = generate_password_hash(
+                        request.form['new_password'],
+                        method='pbkdf2:sha256'
+                    )
+                    flash('Password updated successfully!', 'success')
+                else:
+                    flash('Current password is incorrect!', 'danger')
+
+            db.session.commit()
+            get_user_directory().invalidate(current_user.id, current_user.role)
+            flash('Profile updated successfully!', 'success')
+            return redirect(url_for('profile'))
+
+        return render_template('profile.html')
+
+    @app.route('/manufacturer', methods=['GET', 'POST'])
+    @login_required
+    def manufacturer():
+        if current_user.role != 'manufacturer':
+            abort(403)
+
+        # Get all distributors
+        distributors = get_user_directory().role_members('distributor')
+
+        if request.method == 'POST':
+            name = request.form['name']
+            batch_id = str(uuid.uuid4())
+            product_id = request.form['product_id']
+            description = request.form['description']
+            medicine_type = request.form['medicine_type']
+            medicine_form = request.form['medicine_form']
+            expiration_date = datetime.strptime(request.form['expiration_date'], '%Y-%m-%d').date()
+            manufacturing_date = datetime.strptime(request.form['manufacturing_date'], '%Y-%m-%d').date()
+            dosage = request.form['dosage']
+            side_effects = request.form['side_effects']
+            storage_conditions = request.form.get('storage_conditions')
+            price = float(request.form.get('price', 0))
+            quantity = int(request.form.get('quantity', 0))
+            reorder_level = int(request.form.get('reorder_level', 10))
+            distributor_id = int(request.form['distributor_id'])  # New field
+
+            qr_code_path = generate_qr_code(batch_id)
+
+            product = Product(
+                name=name, 
+                batch_id=batch_id, 
+                qr_code_path=qr_code_path, 
+                manufacturer_id=current_user.id,
+                distributor_id=distributor_id,  # Add distributor_id
                 product_id=product_id,
-                batch_id=product.batch_id,
-                status=status,
+                description=description,
+                medicine_type=medicine_type,
+                medicine_form=medicine_form,
+                expiration_date=expiration_date,
+                manufacturing_date=manufacturing_date,
+                dosage=dosage,
+                side_effects=side_effects,
+                storage_conditions=storage_conditions,
+                price=price,
                 quantity=quantity,
-                unit_price=unit_price,
-                updated_by=current_user.id
+                reorder_level=reorder_level
             )
-            db.session.add(inventory)
-            
-            # Update product quantity
-            product.quantity = quantity
-            if quantity <= product.reorder_level:
-                alert = Alert(
-                    user_id=current_user.id,
-                    product_id=product_id,
-                    type='inventory',
-                    message=f'Low stock alert for {product.name}'
-                )
-                db.session.add(alert)
-            
+            db.session.add(product)
             db.session.commit()
-            
+
             # Add to blockchain
-            inventory_data = {
+            product_data = {
+                'name': name,
                 'product_id': product_id,
-                'status': status,
+                'manufacturer_id': current_user.id,
+                'distributor_id': distributor_id,  # Add distributor_id
+                'description': description,
+                'medicine_type': medicine_type,
+                'medicine_form': medicine_form,
+                'expiration_date': expiration_date.isoformat(),
+                'manufacturing_date': manufacturing_date.isoformat(),
+                'dosage': dosage,
+                'side_effects': side_effects,
+                'storage_conditions': storage_conditions,
+                'price': price,
                 'quantity': quantity,
-                'unit_price': unit_price
+                'created_at': datetime.utcnow().isoformat()
             }
-            add_to_blockchain('inventory_update', product.batch_id, inventory_data, status, current_user.id)
-            
-            flash('Inventory updated successfully!', 'success')
-            return redirect(url_for('pharmacy'))
-    
-    products = Product.query.all()
-    inventory = PharmacyInventory.query.all()
-    alerts = Alert.query.filter_by(user_id=current_user.id, is_read=False).all()
-    
-    # Get analytics data
-    total_inventory = len(inventory)
-    low_stock = len([i for i in inventory if i.quantity <= Product.query.get(i.product_id).reorder_level])
-    total_value = sum([i.quantity * i.unit_price for i in inventory])
-    expiring_soon = len([i for i in inventory if Product.query.get(i.product_id).expiration_date <= date.today() + timedelta(days=30)])
-    
-    return render_template(
-        'pharmacy.html',
-        products=products,
-        inventory=inventory,
-        alerts=alerts,
-        analytics={
-            'total_inventory': total_inventory,
-            'low_stock': low_stock,
-            'total_value': total_value,
-            'expiring_soon': expiring_soon
-        }
-    )
+            add_to_blockchain('product_creation', batch_id, product_data)
 
-@app.route('/track/<batch_id>')
-def track_product(batch_id):
-    product = Product.query.filter_by(batch_id=batch_id).first_or_404()
-    manufacturer = User.query.get(product.manufacturer_id)
-    distributor = User.query.filter_by(role='distributor').first()
-    pharmacy = User.query.filter_by(role='pharmacy').first()
-    # Get tracking history from database
-    tracking_logs = TransportTracking.query.filter_by(product_id=product.id).order_by(TransportTracking.updated_at).all()
-    
-    # Get tracking history from blockchain
-    blockchain_history = get_product_history(batch_id)
-    
-    # Process tracking logs
-    history_details = []
-    for log in tracking_logs:
-        # Get the user who updated the log
-        updated_by_user = User.query.get(log.updated_by)
-        
-        history_details.append({
-            'status': log.tracking_status,
-            'timestamp': log.updated_at,
-            'current_location': log.current_location,
-            'temperature': log.temperature,
-            'humidity': log.humidity,
-            'updated_by': updated_by_user.username if updated_by_user else 'System',
-            'carrier': log.carrier,
-            'tracking_number': log.tracking_number,
-            'manufacturer_name': manufacturer.username,  # Add manufacturer name
-            'manufacturer_email': manufacturer.email , # Add manufacturer email
-            'distributor_name': distributor.username,  # Add manufacturer name
-            'distributor_email': distributor.email
-        })
+            flash('Product added and QR code generated!', 'success')
+            return redirect(url_for('manufacturer'))
 
-    return render_template(
-        'consumer.html', 
-        product=product, 
-        manufacturer=manufacturer,
-        distributor=distributor,
-        pharmacy=pharmacy,
-        history=history_details,
-    )
+        products = Product.query.filter_by(manufacturer_id=current_user.id).all()
+        alerts = Alert.query.filter_by(user_id=current_user.id, is_read=False).all()
+
+        # Get analytics data
+        total_products = len(products)
+        active_products = len([p for p in products if p.status == 'Active'])
+        low_stock_products = len([p for p in products if p.quantity <= p.reorder_level])
+        expiring_soon = len([p for p in products if p.expiration_date <= date.today() + timedelta(days=30)])
+
+        return render_template(
+            'manufacturer.html',
+            products=products,
+            distributors=distributors,  # Pass distributors to template
+            medicine_types=MEDICINE_TYPES,
+            medicine_forms=MEDICINE_FORMS,
+            alerts=alerts,
+            analytics={
+                'total_products': total_products,
+                'active_products': active_products,
+                'low_stock': low_stock_products,
+                'expiring_soon': expiring_soon
+            }
+        )
+
+    @app.route('/distributor', methods=['GET', 'POST'])
+    @login_required
+    def distributor():
+        if current_user.role != 'distributor':
+            abort(403)
+
+        # Get all pharmacies
+        pharmacies = get_user_directory().role_members('pharmacy')
+
+        if request.method == 'POST':
+            product_id = request.form['product_id']
+            tracking_status = request.form['tracking_status']
+            current_location = request.form['current_location']
+            temperature = request.form.get('temperature')
+            humidity = request.form.get('humidity')
+            transport_conditions = request.form.get('transport_conditions')
+            expected_delivery_date = request.form.get('expected_delivery_date')
+            carrier = request.form.get('carrier')
+            tracking_number = request.form.get('tracking_number')
+            notes = request.form.get('notes')
+            pharmacy_id = int(request.form['pharmacy_id'])  # New field
+
+            # Update product with pharmacy_id
+            product = Product.query.get(product_id)
+            if product:
+                product.pharmacy_id = pharmacy_id
+
+                # Add tracking details
+                transport_tracking = TransportTracking(
+                    product_id=product_id,
+                    tracking_status=tracking_status,
+                    current_location=current_location,
+                    temperature=temperature,
+                    humidity=humidity,
+                    transport_conditions=transport_conditions,
+                    expected_delivery_date=datetime.strptime(expected_delivery_date, '%Y-%m-%d') if expected_delivery_date else None,
+                    carrier=carrier,
+                    tracking_number=tracking_number,
+                    notes=notes,
+                    updated_by=current_user.id
+                )
+                db.session.add(transport_tracking)
+                db.session.commit()
+
+                # Add to blockchain
+                tracking_data = {
+                    'product_id': product_id,
+                    'pharmacy_id': pharmacy_id,  # Add pharmacy_id
+                    'status': tracking_status,
+                    'current_location': current_location,
+                    'temperature': temperature,
+                    'humidity': humidity,
+                    'transport_conditions': transport_conditions,
+                    'expected_delivery_date': expected_delivery_date,
+                    'carrier': carrier,
+                    'tracking_number': tracking_number,
+                    'notes': notes
+                }
+                add_to_blockchain('status_update', product.batch_id, tracking_data, status=tracking_status, updated_by=current_user.id)
+
+                flash('Product tracking updated successfully!', 'success')
+                return redirect(url_for('distributor'))
+
+        products = Product.query.filter_by(distributor_id=current_user.id).all()
+        tracking_history = TransportTracking.query.all()
+
+        # Get analytics data
+        total_shipments = len(tracking_history)
+        in_transit = len([t for t in tracking_history if t.tracking_status == 'In Transit'])
+        delivered = len([t for t in tracking_history if t.tracking_status == 'Delivered'])
+        delayed = len([t for t in tracking_history if t.expected_delivery_date and t.expected_delivery_date < date.today()])
+
+        return render_template(
+            'distributor.html',
+            products=products,
+            pharmacies=pharmacies,  # Pass pharmacies to template
+            tracking_history=tracking_history,
+            analytics={
+                'total_shipments': total_shipments,
+                'in_transit': in_transit,
+                'delivered': delivered,
+                'delayed': delayed
+            }
+        )
 
-@app.route('/alerts')
-@login_required
-def alerts():
-    alerts = Alert.query.filter_by(user_id=current_user.id).order_by(Alert.created_at.desc()).all()
-    return render_template('alerts.html', alerts=alerts)
-
-@app.route('/mark_alert_read/<int:alert_id>')
-@login_required
-def mark_alert_read(alert_id):
-    alert = Alert.query.get_or_404(alert_id)
-    if alert.user_id == current_user.id:
-        alert.is_read = True
+    @app.route('/api/telemetry/<batch_id>', methods=['POST'])
+    @login_required
+    def ingest_telemetry(batch_id):
+        if current_user.role != 'distributor':
+            abort(403)
+
+        product = Product.query.filter_by(batch_id=batch_id).first_or_404()
+        payload = request.get_json(silent=True) or {}
+        readings = payload.get('readings')
+        if not isinstance(readings, list) or not readings:
+            return jsonify({'error': 'Expected a non-empty "readings" list'}), 400
+        if len(readings) > app.config['TELEMETRY_MAX_READINGS']:
+            return jsonify({'error': f"At most {app.config['TELEMETRY_MAX_READINGS']} readings per request"}), 413
+        try:
+            batch = TelemetryBatch.from_readings(readings)
+        except TelemetryError as e:
+            return jsonify({'error': str(e)}), 400
+
+        limits = parse_storage_conditions(product.storage_conditions)
+        excursions = detect_excursions(batch, limits)
+
+        db.session.add(TelemetryChunk(
+            product_id=product.id,
+            start_time=batch.timestamps[0],
+            end_time=batch.timestamps[-1],
+            reading_count=len(batch),
+            excursion_count=len(excursions),
+            data=batch.pack(),
+            uploaded_by=current_user.id
+        ))
+        merge_telemetry_aggregates(product.id, batch, app.config['TELEMETRY_INTERVAL'])
+        if excursions:
+            message = (f'{len(excursions)} storage excursion(s) for {product.name} (Batch: {product.batch_id}); '
+                       f'storage conditions: {product.storage_conditions}')
+            for user_id in {product.manufacturer_id, current_user.id}:
+                db.session.add(Alert(user_id=user_id, product_id=product.id, type='excursion', message=message))
         db.session.commit()
-    return redirect(url_for('alerts'))
+
+        # Only excursions and a per-batch summary go to the chain, never raw points
+        summary = summarize(batch)
+        excursion_data = [excursion._asdict() for excursion in excursions]
+        if excursions:
+            add_to_blockchain('telemetry_excursion', batch_id, {
+                'product_id': product.id,
+                'limits': limits._asdict(),
+                'excursions': excursion_data
+            }, status='Excursion', updated_by=current_user.id)
+        add_to_blockchain('telemetry_summary', batch_id, {
+            'product_id': product.id,
+            'start_time': batch.timestamps[0],
+            'end_time': batch.timestamps[-1],
+            'reading_count': len(batch),
+            'excursion_count': len(excursions),
+            'summary': summary
+        }, updated_by=current_user.id)
+
+        return jsonify({
+            'batch_id': batch_id,
+            'accepted': len(batch),
+            'summary': summary,
+            'excursions': excursion_data
+        }), 201
+
+    @app.route('/api/telemetry/<batch_id>', methods=['GET'])
+    @login_required
+    def telemetry_aggregates(batch_id):
+        product = Product.query.filter_by(batch_id=batch_id).first_or_404()
+        interval = app.config['TELEMETRY_INTERVAL']
+        query = TelemetryAggregate.query.filter_by(product_id=product.id, interval=interval)
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        if since is not None:
+            query = query.filter(TelemetryAggregate.bucket_start >= since)
+        if until is not None:
+            query = query.filter(TelemetryAggregate.bucket_start <= until)
+
+        series = {metric: [] for metric in TELEMETRY_METRICS}
+        for row in query.order_by(TelemetryAggregate.bucket_start):
+            series[row.metric].append({
+                'bucket_start': row.bucket_start,
+                'count': row.count,
+                'min': row.minimum,
+                'max': row.maximum,
+                'avg': row.total / row.count
+            })
+        return jsonify({
+            'batch_id': batch_id,
+            'interval': interval,
+            'limits': parse_storage_conditions(product.storage_conditions)._asdict(),
+            'series': series
+        })
+
+    @app.route('/pharmacy', methods=['GET', 'POST'])
+    @login_required
+    def pharmacy():
+        if current_user.role != 'pharmacy':
+            abort(403)
+
+        if request.method == 'POST':
+            product_id = request.form['product_id']
+            status = request.form['status']
+            quantity = int(request.form.get('quantity', 0))
+            unit_price = float(request.form.get('unit_price', 0))
+
+            product = Product.query.get(product_id)
+            if product:
+                inventory = PharmacyInventory(
+                    product_id=product_id,
+                    batch_id=product.batch_id,
+                    status=status,
+                    quantity=quantity,
+                    unit_price=unit_price,
+                    updated_by=current_user.id
+                )
+                db.session.add(inventory)
+
+                # Update product quantity
+                product.quantity = quantity
+                if quantity <= product.reorder_level:
+                    alert = Alert(
+                        user_id=current_user.id,
+                        product_id=product_id,
+                        type='inventory',
+                        message=f'Low stock alert for {product.name}'
+                    )
+                    db.session.add(alert)
+
+                db.session.commit()
+
+                # Add to blockchain
+                inventory_data = {
+                    'product_id': product_id,
+                    'status': status,
+                    'quantity': quantity,
+                    'unit_price': unit_price
+                }
+                add_to_blockchain('inventory_update', product.batch_id, inventory_data, status, current_user.id)
+
+                flash('Inventory updated successfully!', 'success')
+                return redirect(url_for('pharmacy'))
+
+        products = Product.query.all()
+        inventory = PharmacyInventory.query.all()
+        alerts = Alert.query.filter_by(user_id=current_user.id, is_read=False).all()
+
+        # Get analytics data
+        total_inventory = len(inventory)
+        low_stock = len([i for i in inventory if i.quantity <= Product.query.get(i.product_id).reorder_level])
+        total_value = sum([i.quantity * i.unit_price for i in inventory])
+        expiring_soon = len([i for i in inventory if Product.query.get(i.product_id).expiration_date <= date.today() + timedelta(days=30)])
+
+        return render_template(
+            'pharmacy.html',
+            products=products,
+            inventory=inventory,
+            alerts=alerts,
+            analytics={
+                'total_inventory': total_inventory,
+                'low_stock': low_stock,
+                'total_value': total_value,
+                'expiring_soon': expiring_soon
+            }
+        )
+
+    @app.route('/api/verify_batches', methods=['POST'])
+    @login_required
+    def verify_batches():
+        if current_user.role != 'pharmacy':
+            abort(403)
+
+        batch_ids = (request.get_json(silent=True) or {}).get('batch_ids')
+        if not isinstance(batch_ids, list) or not batch_ids:
+            return jsonify({'error': 'Expected a non-empty "batch_ids" list'}), 400
+        if len(batch_ids) > 5000:
+            return jsonify({'error': 'At most 5000 batch ids per request'}), 413
+        batch_ids = list(dict.fromkeys(str(batch_id) for batch_id in batch_ids))
+
+        products = {}
+        for chunk in chunked(batch_ids):
+            for product in Product.query.filter(Product.batch_id.in_(chunk)):
+                products[product.batch_id] = product
+
+        # Latest tracking row per product: one grouped subquery per chunk
+        latest_tracking = {}
+        product_ids = [product.id for product in products.values()]
+        for chunk in chunked(product_ids):
+            latest_ids = db.session.query(db.func.max(TransportTracking.id)).filter(
+                TransportTracking.product_id.in_(chunk)
+            ).group_by(TransportTracking.product_id)
+            for log in TransportTracking.query.filter(TransportTracking.id.in_(latest_ids)):
+                latest_tracking[log.product_id] = log
+
+        chain_statuses = get_batch_statuses(batch_ids)
+
+        today = date.today()
+        results = []
+        for batch_id in batch_ids:
+            product = products.get(batch_id)
+            chain = chain_statuses.get(batch_id) if chain_statuses is not None else None
+            if product is None:
+                results.append({'batch_id': batch_id, 'found': False, 'chain': chain})
+                continue
+
+            log = latest_tracking.get(product.id)
+            results.append({
+                'batch_id': batch_id,
+                'found': True,
+                'product': {
+                    'name': product.name,
+                    'product_id': product.product_id,
+                    'medicine_type': product.medicine_type,
+                    'medicine_form': product.medicine_form,
+                    'manufacturer_id': product.manufacturer_id,
+                    'manufacturing_date': product.manufacturing_date.isoformat(),
+                    'expiration_date': product.expiration_date.isoformat(),
+                    'quantity': product.quantity,
+                    'status': product.status
+                },
+                'latest_tracking': {
+                    'status': log.tracking_status,
+                    'current_location': log.current_location,
+                    'updated_at': log.updated_at.isoformat() if log.updated_at else None
+                } if log else None,
+                'chain': chain,
+                'expired': product.expiration_date < today,
+                'expiring_soon': today <= product.expiration_date <= today + timedelta(days=30)
+            })
+
+        return jsonify({
+            'results': results,
+            'summary': {
+                'requested': len(batch_ids),
+                'found': sum(1 for r in results if r['found']),
+                'chain_confirmed': sum(1 for r in results if r['chain'] and r['chain']['confirmed']),
+                'expired': sum(1 for r in results if r.get('expired')),
+                'chain_available': chain_statuses is not None
+            }
+        })
+
+    @app.route('/track/<batch_id>')
+    def track_product(batch_id):
+        product = Product.query.filter_by(batch_id=batch_id).first_or_404()
+        users = get_user_directory()
+        manufacturer = users.get(product.manufacturer_id)
+        distributor = users.first_in_role('distributor')
+        pharmacy = users.first_in_role('pharmacy')
+        # Get tracking history from database
+        tracking_logs = TransportTracking.query.filter_by(product_id=product.id).order_by(TransportTracking.updated_at).all()
+
+        # Get tracking history from blockchain
+        blockchain_history = get_product_history(batch_id)
+
+        # Process tracking logs
+        history_details = []
+        for log in tracking_logs:
+            # Get the user who updated the log
+            updated_by_user = users.get(log.updated_by)
+
+            history_details.append({
+                'status': log.tracking_status,
+                'timestamp': log.updated_at,
+                'current_location': log.current_location,
+                'temperature': log.temperature,
+                'humidity': log.humidity,
+                'updated_by': updated_by_user.username if updated_by_user else 'System',
+                'carrier': log.carrier,
+                'tracking_number': log.tracking_number,
+                'manufacturer_name': manufacturer.username,  # Add manufacturer name
+                'manufacturer_email': manufacturer.email , # Add manufacturer email
+                'distributor_name': distributor.username,  # Add manufacturer name
+                'distributor_email': distributor.email
+            })
+
+        return render_template(
+            'consumer.html', 
+            product=product, 
+            manufacturer=manufacturer,
+            distributor=distributor,
+            pharmacy=pharmacy,
+            history=history_details,
+        )
+
+    @app.route('/alerts')
+    @login_required
+    def alerts():
+        alerts = Alert.query.filter_by(user_id=current_user.id).order_by(Alert.created_at.desc()).all()
+        return render_template('alerts.html', alerts=alerts)
+
+    @app.route('/mark_alert_read/<int:alert_id>')
+    @login_required
+    def mark_alert_read(alert_id):
+        alert = Alert.query.get_or_404(alert_id)
+        if alert.user_id == current_user.id:
+            alert.is_read = True
+            db.session.commit()
+        return redirect(url_for('alerts'))
 
 # @app.route('/reports')
 # @login_required
 # def reports():
 #     if request.args.get('format') == 'excel':
-#         # Generate Excel report
+#         # Generate Excel report; pandas is heavy, so it is only loaded here
+#         import pandas as pd
+#         from io import BytesIO
 #         output = BytesIO()
 #         writer = pd.ExcelWriter(output, engine='xlsxwriter')
         
@@ -677,6 +1075,7 @@ def mark_alert_read(alert_id):
 #     return jsonify(data)
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         db.create_all()
     app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""Cold storage for the transaction bodies of old blocks.
+
+Blocks more than `hot_blocks` behind the tip hand their transaction lists to
+a BlockArchive. Headers (hashes, Merkle roots, links) and the ChainIndex stay
+in memory. Bodies are written to append-only segment files as zlib-compressed
+frames of about `frame_bytes` of JSON each. Block.transactions reads them back
+on demand through a bounded LRU of decoded frames.
+
+The catalog that maps block hashes to frames lives in memory. Segments are a
+way to spill memory, not a persistence format, and each archive writes to its
+own temporary subdirectory, which is removed when the archive goes away.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+ARCHIVE_READS = REGISTRY.counter(
+    'ledger_archive_reads_total', 'Archived block bodies read, by frame cache outcome', ('outcome',)
+)
+ARCHIVED_BLOCKS = REGISTRY.gauge(
+    'ledger_archived_blocks', 'Blocks whose transaction bodies live in the archive'
+)
+
+FrameRef = Tuple[int, int, int]  # (segment number, byte offset, compressed length)
+
+
+class BlockArchive:
+    def __init__(self, directory: str, hot_blocks: int = 10000, segment_blocks: int = 1000,
+                 cache_frames: int = 256, frame_bytes: int = 64 * 1024, compression_level: int = 6):
+        if hot_blocks < 1 or segment_blocks < 1 or cache_frames < 1:
+            raise ValueError('hot_blocks, segment_blocks and cache_frames must be positive')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='segments-', dir=directory)
+        weakref.finalize(self, shutil.rmtree, self.directory, True)
+        self.hot_blocks = hot_blocks
+        self.segment_blocks = segment_blocks
+        self.cache_frames = cache_frames
+        self.frame_bytes = frame_bytes
+        self.compression_level = compression_level
+
+        self._catalog: Dict[str, Tuple[FrameRef, int]] = {}  # block hash -> (frame, position)
+        self._segments: List[str] = []
+        self._cache: 'OrderedDict[FrameRef, List[List[Dict]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self._catalog
+
+    def __len__(self) -> int:
+        return len(self._catalog)
+
+    def store(self, blocks: List) -> None:
+        """Write the bodies of blocks to a new segment, then drop them from memory.
+
+        Blocks already archived (for example the shared prefix of a chain
+        adopted from a peer) are not written again.
+        """
+        with self._write_lock:
+            new_blocks = [block for block in blocks if block.hash not in self._catalog]
+            if new_blocks:
+                self._write_segment(new_blocks)
+        for block in blocks:
+            block.release_transactions(self)
+        ARCHIVED_BLOCKS.set(len(self._catalog))
+
+    def _write_segment(self, blocks: List) -> None:
+        segment = len(self._segments)
+        path = os.path.join(self.directory, f'{segment:08d}.seg')
+        entries: Dict[str, Tuple[FrameRef, int]] = {}
+        with open(path, 'wb') as f:
+            bodies: List[str] = []
+            hashes: List[str] = []
+            size = 0
+
+            def write_frame():
+                # Key order is preserved, so Merkle roots still verify on reload
+                data = zlib.compress(('[' + ','.join(bodies) + ']').encode(), self.compression_level)
+                ref = (segment, f.tell(), len(data))
+                f.write(data)
+                for position, block_hash in enumerate(hashes):
+                    entries[block_hash] = (ref, position)
+                bodies.clear()
+                hashes.clear()
+
+            for block in blocks:
+                body = json.dumps(block.transactions)
+                bodies.append(body)
+                hashes.append(block.hash)
+                size += len(body)
+                if size >= self.frame_bytes:
+                    write_frame()
+                    size = 0
+            if bodies:
+                write_frame()
+
+        with self._lock:
+            self._segments.append(path)
+            self._catalog.update(entries)
+
+    def load(self, block_hash: str) -> List[Dict]:
+        """Transactions of an archived block"""
+        ref, position = self._catalog[block_hash]
+        with self._lock:
+            frame = self._cache.get(ref)
+            if frame is not None:
+                self._cache.move_to_end(ref)
+        if frame is not None:
+            ARCHIVE_READS.inc(outcome='hit')
+            return frame[position]
+
+        ARCHIVE_READS.inc(outcome='miss')
+        segment, offset, length = ref
+        with open(self._segments[segment], 'rb') as f:
+            f.seek(offset)
+            frame = json.loads(zlib.decompress(f.read(length)))
+        with self._lock:
+            self._cache[ref] = frame
+            if len(self._cache) > self.cache_frames:
+                self._cache.popitem(last=False)
+        return frame[position]
+
+
+def archive_from_env(environ=os.environ) -> Optional[BlockArchive]:
+    """Build the archive configured through LEDGER_ARCHIVE_* variables; None when unset"""
+    directory = environ.get('LEDGER_ARCHIVE_DIR')
+    if not directory:
+        return None
+    return BlockArchive(
+        directory,
+        hot_blocks=int(environ.get('LEDGER_ARCHIVE_HOT_BLOCKS', '10000')),
+        segment_blocks=int(environ.get('LEDGER_ARCHIVE_SEGMENT_BLOCKS', '1000')),
+        cache_frames=int(environ.get('LEDGER_ARCHIVE_CACHE_FRAMES', '256')),
+    )
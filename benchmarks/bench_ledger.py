@@ -0,0 +1,179 @@
+"""Benchmarks for the ledger hot paths in blockchain.py and blockchain_server.py.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ledger --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import random
+from time import time
+from typing import Any, Dict, List
+
+from archive import BlockArchive
+from blockchain import Block, Blockchain
+from blockchain_server import BlockchainServer
+from consensus import AuthorityConsensus, HmacKey
+from benchmarks.harness import measure, print_result, write_results
+
+TX_TYPES = ['product_creation', 'status_update', 'inventory_update']
+STATUSES = ['Manufactured', 'In Transit', 'Delivered', 'Received', 'Sold']
+
+
+def make_transaction(i: int, batch_count: int) -> Dict[str, Any]:
+    """Build a transaction shaped like the ones app.py submits"""
+    return {
+        'type': TX_TYPES[i % len(TX_TYPES)],
+        'batch_id': f'batch-{i % batch_count:08d}',
+        'timestamp': 1700000000.0 + i,
+        'product_data': {
+            'product_id': str(i),
+            'current_location': 'Warehouse 7',
+            'temperature': '4.5',
+            'humidity': '40',
+        },
+        'status': STATUSES[i % len(STATUSES)],
+        'updated_by': i % 50,
+    }
+
+
+def build_chain(tx_count: int, tx_per_block: int, archive: BlockArchive = None) -> Blockchain:
+    """Seed a chain with tx_count transactions without paying for proof of work.
+
+    The chain keeps difficulty 0 so is_chain_valid walks every block instead
+    of failing on the first one.
+    """
+    blockchain = Blockchain(archive=archive)
+    blockchain.difficulty = 0
+    batch_count = max(1, tx_count // 10)
+    for i in range(tx_count):
+        blockchain.add_transaction(make_transaction(i, batch_count))
+        if len(blockchain.pending_transactions) >= tx_per_block:
+            blockchain.mine_pending_transactions()
+    blockchain.mine_pending_transactions()
+    return blockchain
+
+
+def bench_mining(difficulties: List[int], tx_per_block: int, repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    transactions = [make_transaction(i, 10) for i in range(tx_per_block)]
+    for difficulty in difficulties:
+        blockchain = Blockchain()
+        blockchain.difficulty = difficulty
+        attempts: List[int] = []
+
+        def setup():
+            return Block(1, transactions, random.random() + time(), blockchain.chain[-1].hash)
+
+        def mine(block):
+            blockchain._mine_block(block)
+            attempts.append(block.nonce + 1)
+
+        timing = measure(mine, repeat=repeat, setup=setup)
+        results.append({
+            'name': 'blockchain.mine_block',
+            'params': {'difficulty': difficulty, 'transactions': tx_per_block},
+            'timing': timing,
+            'mean_nonce_attempts': sum(attempts) / len(attempts),
+        })
+
+    authority = Blockchain(AuthorityConsensus({'node-1': HmacKey(b'benchmark-secret')}, 'node-1'))
+    results.append({
+        'name': 'blockchain.mine_block',
+        'params': {'consensus': 'authority-hmac', 'transactions': tx_per_block},
+        'timing': measure(
+            authority._mine_block, repeat=repeat,
+            setup=lambda: Block(1, transactions, time(), authority.chain[-1].hash)
+        ),
+    })
+    return results
+
+
+def bench_merkle(tx_counts: List[int], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for count in tx_counts:
+        block = Block(1, [make_transaction(i, 10) for i in range(count)], time(), '0')
+        results.append({
+            'name': 'block.calculate_merkle_root',
+            'params': {'transactions': count},
+            'timing': measure(block.calculate_merkle_root, repeat=repeat),
+        })
+    return results
+
+
+def bench_chain(sizes: List[int], tx_per_block: int, repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        blockchain = build_chain(size, tx_per_block)
+        assert blockchain.is_chain_valid()
+        # Fewer repetitions on the big chains keeps a full run practical
+        runs = repeat if size < 100000 else max(1, repeat // 3)
+        params = {'transactions': size, 'blocks': len(blockchain.chain)}
+
+        last_hash = blockchain.chain[-1].transactions[-1]['hash']
+        middle = blockchain.chain[len(blockchain.chain) // 2].transactions[0]
+        results.append({
+            'name': 'blockchain.is_chain_valid',
+            'params': params,
+            'timing': measure(blockchain.is_chain_valid, repeat=runs),
+        })
+        results.append({
+            'name': 'blockchain.verify_transaction',
+            'params': {**params, 'case': 'last'},
+            'timing': measure(lambda: blockchain.verify_transaction(last_hash), repeat=repeat),
+        })
+        results.append({
+            'name': 'blockchain.verify_transaction',
+            'params': {**params, 'case': 'missing'},
+            'timing': measure(lambda: blockchain.verify_transaction('0' * 64), repeat=repeat),
+        })
+
+        results.append({
+            'name': 'blockchain.query_transactions',
+            'params': {**params, 'filters': 'type,updated_by', 'limit': 100},
+            'timing': measure(
+                lambda: blockchain.query_transactions({'type': 'status_update', 'updated_by': '7'}),
+                repeat=repeat
+            ),
+        })
+
+        server = BlockchainServer()
+        server.blockchain = blockchain
+        client = server.app.test_client()
+        batch_id = middle['batch_id']
+        results.append({
+            'name': 'server.get_product_history',
+            'params': params,
+            'timing': measure(lambda: client.get(f'/get_product_history/{batch_id}'), repeat=repeat),
+        })
+        for result in results[-5:]:
+            print_result(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ledger hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='chain sizes in transactions')
+    parser.add_argument('--difficulties', type=int, nargs='+', default=[1, 2, 3, 4])
+    parser.add_argument('--merkle-sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--tx-per-block', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='path of the JSON results file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = []
+    for result in bench_mining(args.difficulties, args.tx_per_block, args.repeat):
+        print_result(result)
+        results.append(result)
+    for result in bench_merkle(args.merkle_sizes, args.repeat):
+        print_result(result)
+        results.append(result)
+    results.extend(bench_chain(args.sizes, args.tx_per_block, args.repeat))
+
+    print(f"Results written to {write_results('ledger', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
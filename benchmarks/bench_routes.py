@@ -0,0 +1,218 @@
+"""Benchmarks for the Flask routes in app.py against seeded SQLite databases.
+
+The web app talks to a real BlockchainServer started in a background thread,
+so /track/<batch_id> pays for the same history call it makes in production.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_routes --products 100 1000 10000
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
+
+from werkzeug.serving import make_server
+
+from blockchain_server import BlockchainServer
+from metrics import REGISTRY
+from benchmarks.harness import measure, print_result, write_results
+
+STATUSES = ['Dispatched', 'In Transit', 'Delivered']
+
+
+def start_blockchain_server() -> BlockchainServer:
+    """Run a BlockchainServer on a free local port in a daemon thread"""
+    server = BlockchainServer(host='127.0.0.1', port=0)
+    server.blockchain.difficulty = 0
+    http_server = make_server('127.0.0.1', 0, server.app, threaded=True)
+    server.port = http_server.server_port
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return server
+
+
+def seed(app_module, chain: BlockchainServer, products: int, tracking_per_product: int,
+         inventory_ratio: float) -> Dict[str, Any]:
+    """Reset the database and fill it with a synthetic supply chain"""
+    db = app_module.db
+    db.drop_all()
+    db.create_all()
+
+    users = []
+    for role, count in (('manufacturer', 5), ('distributor', 20), ('pharmacy', 100)):
+        for i in range(count):
+            users.append(app_module.User(
+                username=f'{role}{i}',
+                email=f'{role}{i}@example.com',
+                password='not-a-real-hash',
+                role=role,
+                company_name=f'{role.title()} {i} Ltd',
+            ))
+    db.session.add_all(users)
+    db.session.commit()
+    app_module.get_user_directory().clear()
+    by_role: Dict[str, List[int]] = {}
+    for user in users:
+        by_role.setdefault(user.role, []).append(user.id)
+
+    today = date.today()
+    rows = []
+    for i in range(products):
+        rows.append(app_module.Product(
+            name=f'Medicine {i}',
+            batch_id=f'batch-{i:08d}',
+            qr_code_path=f'static/qr_codes/batch-{i:08d}.png',
+            manufacturer_id=random.choice(by_role['manufacturer']),
+            distributor_id=random.choice(by_role['distributor']),
+            product_id=f'P{i:08d}',
+            medicine_type=app_module.MEDICINE_TYPES[i % len(app_module.MEDICINE_TYPES)],
+            medicine_form=app_module.MEDICINE_FORMS[i % len(app_module.MEDICINE_FORMS)],
+            expiration_date=today + timedelta(days=random.randint(-30, 720)),
+            manufacturing_date=today - timedelta(days=random.randint(30, 365)),
+            storage_conditions='Store between 2-8°C',
+            price=round(random.uniform(1, 100), 2),
+            quantity=random.randint(0, 500),
+        ))
+    db.session.add_all(rows)
+    db.session.commit()
+    product_ids = [p.id for p in rows]
+
+    tracking = []
+    for product_id in product_ids:
+        for step in range(tracking_per_product):
+            tracking.append(app_module.TransportTracking(
+                product_id=product_id,
+                tracking_status=STATUSES[step % len(STATUSES)],
+                current_location=f'Hub {step}',
+                temperature=round(random.uniform(2, 8), 1),
+                humidity=round(random.uniform(30, 60), 1),
+                updated_at=datetime.utcnow() - timedelta(hours=tracking_per_product - step),
+                updated_by=random.choice(by_role['distributor']),
+            ))
+    inventory = []
+    for product in rows[:int(products * inventory_ratio)]:
+        inventory.append(app_module.PharmacyInventory(
+            product_id=product.id,
+            batch_id=product.batch_id,
+            quantity=random.randint(0, 200),
+            unit_price=product.price,
+            updated_by=random.choice(by_role['pharmacy']),
+        ))
+    db.session.add_all(tracking + inventory)
+    db.session.commit()
+
+    # Mirror product creation on the chain, plus a full history for the tracked batch
+    tracked = rows[len(rows) // 2]
+    for product in rows:
+        chain.blockchain.add_transaction({
+            'type': 'product_creation',
+            'batch_id': product.batch_id,
+            'product_data': {'product_id': product.id},
+        })
+    for step in range(tracking_per_product):
+        chain.blockchain.add_transaction({
+            'type': 'status_update',
+            'batch_id': tracked.batch_id,
+            'product_data': {'product_id': tracked.id},
+        })
+    chain.blockchain.mine_pending_transactions()
+
+    return {
+        'batch_id': tracked.batch_id,
+        'batch_ids': [product.batch_id for product in rows],
+        'manufacturer_id': by_role['manufacturer'][0],
+        'distributor_id': by_role['distributor'][0],
+        'pharmacy_id': by_role['pharmacy'][0],
+    }
+
+
+def login(client, user_id: int) -> None:
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def queries_per_request(route: str, before: tuple) -> float:
+    """Mean SQL statements per request for route since `before` = (count, sum)"""
+    histogram = REGISTRY.get('sqlalchemy_request_queries')
+    count = histogram.count(route=route) - before[0]
+    return (histogram.sum(route=route) - before[1]) / count if count else 0.0
+
+
+def bench_routes(app_module, flask_app, chain: BlockchainServer, sizes: List[int], tracking_per_product: int,
+                 verify_batch: int, repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        with flask_app.app_context():
+            seeded = seed(app_module, chain, size, tracking_per_product, inventory_ratio=0.5)
+        params = {'products': size, 'tracking_rows': size * tracking_per_product}
+
+        client = flask_app.test_client()
+        # Half of the verified ids are unknown, as with a pallet of mixed stock
+        verify_ids = seeded['batch_ids'][:verify_batch // 2]
+        verify_ids += [f'unknown-{i}' for i in range(verify_batch - len(verify_ids))]
+        cases = [
+            ('/track/<batch_id>', f"/track/{seeded['batch_id']}", None, None),
+            ('/manufacturer', '/manufacturer', seeded['manufacturer_id'], None),
+            ('/distributor', '/distributor', seeded['distributor_id'], None),
+            ('/pharmacy', '/pharmacy', seeded['pharmacy_id'], None),
+            ('/api/verify_batches', '/api/verify_batches', seeded['pharmacy_id'], {'batch_ids': verify_ids}),
+        ]
+        for route, url, user_id, payload in cases:
+            if user_id is not None:
+                login(client, user_id)
+
+            def request(url=url, payload=payload):
+                if payload is None:
+                    response = client.get(url)
+                else:
+                    response = client.post(url, json=payload)
+                assert response.status_code == 200, (url, response.status_code)
+
+            histogram = REGISTRY.get('sqlalchemy_request_queries')
+            before = (histogram.count(route=route), histogram.sum(route=route))
+            result = {
+                'name': f'route {route}',
+                'params': params if payload is None else {**params, 'batch_ids': len(verify_ids)},
+                'timing': measure(request, repeat=repeat),
+            }
+            result['queries_per_request'] = queries_per_request(route, before)
+            print_result(result)
+            print(f"{'':<32} queries/request={result['queries_per_request']:.1f}")
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Flask dashboard and tracking routes')
+    parser.add_argument('--products', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='number of seeded products per run')
+    parser.add_argument('--tracking-per-product', type=int, default=3)
+    parser.add_argument('--verify-batch', type=int, default=1000,
+                        help='batch ids per /api/verify_batches request')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='path of the JSON results file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix='mediledger-bench-')
+    chain = start_blockchain_server()
+    import app as app_module
+    flask_app = app_module.create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'BLOCKCHAIN_SERVER_URL': f'http://127.0.0.1:{chain.port}',
+    })
+
+    results = bench_routes(app_module, flask_app, chain, args.products, args.tracking_per_product,
+                           args.verify_batch, args.repeat)
+    print(f"Results written to {write_results('routes', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Startup cost of a web worker: importing app.py and calling create_app().
+
+Each sample runs in a fresh interpreter under `python -X importtime`, so
+module caches from earlier runs do not hide anything. The report gives the
+wall time to a ready app, the resident memory of the process at that point,
+and the modules under app.py that took longest to import.
+
+The run fails (exit status 1) when the median startup time or the resident
+memory exceeds its budget, or when a module that app.py loads lazily
+(pandas, qrcode, PIL, requests) is imported at startup. CI can use it as a
+startup regression check.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --max-startup-ms 600 --max-rss-mb 90
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.harness import write_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ('pandas', 'qrcode', 'PIL', 'requests')
+
+WORKER = '''
+import json, sys
+from time import perf_counter
+from benchmarks.harness import memory_kb
+start = perf_counter()
+import app
+app.create_app()
+seconds = perf_counter() - start
+print(json.dumps({{
+    'seconds': seconds,
+    **memory_kb(),
+    'loaded_lazy_modules': [name for name in {lazy!r} if name in sys.modules],
+}}))
+'''
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """(module, depth, self us, cumulative us) for every line of -X importtime output"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        modules.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def sample(env: Dict[str, str]) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', WORKER.format(lazy=LAZY_MODULES)],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(completed.stderr)
+    app_line = next(module for module in modules if module[0] == 'app' and module[1] == 0)
+    # Direct imports of app.py are listed just before it, one level deeper
+    position = modules.index(app_line)
+    children = []
+    for name, depth, _, cumulative in reversed(modules[:position]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((name, cumulative))
+    result['app_import_us'] = app_line[3]
+    result['app_children'] = children
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure and enforce app.py worker startup cost')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-startup-ms', type=float, default=600.0,
+                        help='budget for the median import + create_app() time')
+    parser.add_argument('--max-rss-mb', type=float, default=90.0,
+                        help='budget for resident memory once the app is built')
+    parser.add_argument('--top', type=int, default=10, help='slowest direct imports to list')
+    parser.add_argument('--output', help='path of the JSON results file')
+    args = parser.parse_args()
+
+    # Keep the worker from touching a real database or chain
+    env = {**os.environ, 'DATABASE_URL': 'sqlite://', 'PYTHONDONTWRITEBYTECODE': '1'}
+    samples = [sample(env) for _ in range(args.repeat)]
+
+    startup_ms = statistics.median(s['seconds'] for s in samples) * 1000
+    import_ms = statistics.median(s['app_import_us'] for s in samples) / 1000
+    rss_mb = max(s['rss_kb'] for s in samples) / 1024
+    loaded = sorted({name for s in samples for name in s['loaded_lazy_modules']})
+    slowest: Dict[str, List[int]] = {}
+    for s in samples:
+        for name, cumulative in s['app_children']:
+            slowest.setdefault(name, []).append(cumulative)
+    slowest_imports = sorted(
+        ((name, statistics.median(values) / 1000) for name, values in slowest.items()),
+        key=lambda item: item[1], reverse=True
+    )[:args.top]
+
+    print(f'startup (import app + create_app) median={startup_ms:8.1f} ms  budget={args.max_startup_ms:.0f} ms')
+    print(f'import app (-X importtime)        median={import_ms:8.1f} ms')
+    print(f'resident memory                   max   ={rss_mb:8.1f} MB  budget={args.max_rss_mb:.0f} MB')
+    for name, milliseconds in slowest_imports:
+        print(f'  {name:<32} {milliseconds:8.1f} ms')
+
+    failures = []
+    if startup_ms > args.max_startup_ms:
+        failures.append(f'startup {startup_ms:.1f} ms is over the {args.max_startup_ms:.0f} ms budget')
+    if rss_mb > args.max_rss_mb:
+        failures.append(f'resident memory {rss_mb:.1f} MB is over the {args.max_rss_mb:.0f} MB budget')
+    if loaded:
+        failures.append(f"lazily loaded modules imported at startup: {', '.join(loaded)}")
+
+    result = {
+        'name': 'startup.app',
+        'params': {'repeat': args.repeat, 'max_startup_ms': args.max_startup_ms, 'max_rss_mb': args.max_rss_mb},
+        'startup_ms': startup_ms,
+        'import_ms': import_ms,
+        'rss_mb': rss_mb,
+        'slowest_imports_ms': dict(slowest_imports),
+        'loaded_lazy_modules': loaded,
+        'failures': failures,
+    }
+    print(f"Results written to {write_results('startup', [result], args.output)}")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def measure(fn: Callable[..., Any], repeat: int = 5, warmup: int = 1,
+            setup: Callable[[], Any] = None) -> Dict[str, float]:
+    """Run fn repeatedly and return timing statistics in seconds.
+
+    When setup is given it runs untimed before every call and its return
+    value is passed to fn.
+    """
+    def run_once() -> float:
+        args = (setup(),) if setup else ()
+        start = perf_counter()
+        fn(*args)
+        return perf_counter() - start
+
+    for _ in range(warmup):
+        run_once()
+
+    samples: List[float] = [run_once() for _ in range(repeat)]
+
+    samples.sort()
+    return {
+        'repeat': repeat,
+        'min': samples[0],
+        'max': samples[-1],
+        'mean': statistics.fmean(samples),
+        'median': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def memory_kb() -> Dict[str, int]:
+    """Current and peak resident set size of this process in kB"""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return {'rss_kb': int(fields['VmRSS'].split()[0]), 'peak_rss_kb': int(fields['VmHWM'].split()[0])}
+    except (OSError, KeyError):
+        import resource  # Not available on Windows
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak //= 1024  # Reported in bytes there
+        return {'rss_kb': peak, 'peak_rss_kb': peak}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(RESULTS_DIR),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_results(suite: str, results: List[Dict[str, Any]], output: str = None) -> str:
+    """Write benchmark results as JSON so runs can be compared over time"""
+    if output is None:
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        output = os.path.join(RESULTS_DIR, f'{suite}-{stamp}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    document = {
+        'suite': suite,
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    return output
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    timing = result.get('timing', {})
+    params = ', '.join(f'{k}={v}' for k, v in result.get('params', {}).items())
+    print(f"{result['name']:<32} {params:<40} median={timing.get('median', 0) * 1000:10.3f} ms")
@@ -0,0 +1,130 @@
+"""Threaded load test: read latency on the ledger while blocks are being mined.
+
+Reader threads look up product histories and verify transaction hashes
+while one miner thread keeps sealing blocks at the configured difficulty.
+The same readers also run with the miner stopped, so the report shows how
+much mining slows reads down. Reads use chain snapshots, so any slowdown
+comes from CPU contention, not from waiting on Blockchain._lock.
+
+Run from the repository root:
+
+    python -m benchmarks.load_mining_reads --difficulty 4 --readers 4 --duration 5
+"""
+import argparse
+import random
+import statistics
+import threading
+from time import perf_counter
+from typing import Any, Dict, List
+
+from benchmarks.bench_ledger import build_chain, make_transaction
+from benchmarks.harness import write_results
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    return {
+        'count': len(samples),
+        'mean': statistics.fmean(samples),
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': samples[-1],
+    }
+
+
+def run_phase(blockchain, batch_ids: List[str], tx_hashes: List[str], readers: int,
+              duration: float, mining: bool, difficulty: int) -> Dict[str, Any]:
+    stop = threading.Event()
+    latencies: Dict[str, List[float]] = {'history': [], 'verify': []}
+    mined = []
+
+    def reader(seed: int):
+        rng = random.Random(seed)
+        history, verify = [], []
+        while not stop.is_set():
+            start = perf_counter()
+            blockchain.get_product_history(rng.choice(batch_ids))
+            history.append(perf_counter() - start)
+
+            start = perf_counter()
+            blockchain.verify_transaction(rng.choice(tx_hashes))
+            verify.append(perf_counter() - start)
+        latencies['history'].extend(history)
+        latencies['verify'].extend(verify)
+
+    def miner():
+        i = 0
+        while not stop.is_set():
+            blockchain.add_transaction(make_transaction(i, len(batch_ids)))
+            if blockchain.mine_pending_transactions() is not None:
+                mined.append(1)
+            i += 1
+
+    blockchain.difficulty = difficulty
+    threads = [threading.Thread(target=reader, args=(seed,)) for seed in range(readers)]
+    if mining:
+        threads.append(threading.Thread(target=miner))
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'mining': mining,
+        'blocks_mined': len(mined),
+        'history_seconds': summarize(latencies['history']),
+        'verify_seconds': summarize(latencies['verify']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure read latency while mining')
+    parser.add_argument('--transactions', type=int, default=100000, help='size of the seeded chain')
+    parser.add_argument('--tx-per-block', type=int, default=100)
+    parser.add_argument('--difficulty', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per phase')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='path of the JSON results file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    blockchain = build_chain(args.transactions, args.tx_per_block)
+    snapshot = blockchain.snapshot()
+    tx_hashes = [tx['hash'] for block in snapshot.blocks for tx in block.transactions]
+    batch_ids = sorted({tx['batch_id'] for block in snapshot.blocks for tx in block.transactions})
+
+    results = []
+    for mining in (False, True):
+        phase = run_phase(blockchain, batch_ids, tx_hashes, args.readers, args.duration,
+                          mining, args.difficulty)
+        result = {
+            'name': 'load.reads_during_mining' if mining else 'load.reads_idle',
+            'params': {
+                'transactions': args.transactions,
+                'difficulty': args.difficulty,
+                'readers': args.readers,
+                'duration': args.duration,
+            },
+            **phase,
+        }
+        history = phase['history_seconds']
+        print(f"{result['name']:<28} blocks_mined={phase['blocks_mined']:<4} "
+              f"history p50={history['p50'] * 1e6:8.1f} us p99={history['p99'] * 1e6:8.1f} us "
+              f"max={history['max'] * 1e3:8.2f} ms")
+        results.append(result)
+
+    print(f"Results written to {write_results('load_mining_reads', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Resident memory of a large chain with and without the block archive.
+
+Each mode builds the same synthetic chain in a fresh subprocess, so memory
+freed by one run cannot hide the cost of the other. The archived mode keeps
+the last --hot-blocks blocks in memory and spills every older body to
+compressed segments in a temporary directory. The report includes RSS, peak
+RSS, segment size on disk, and the latency of history lookups and cold block
+reads.
+
+Run from the repository root (ten million transactions need about 14 GB of
+RAM for the hot run):
+
+    python -m benchmarks.memory_archive --transactions 10000000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+from typing import Any, Dict
+
+from archive import BlockArchive
+from benchmarks.bench_ledger import build_chain
+from benchmarks.harness import measure, memory_kb, write_results
+
+
+def run_mode(mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    random.seed(args.seed)
+    archive = None
+    if mode == 'archived':
+        archive = BlockArchive(
+            tempfile.mkdtemp(prefix='mediledger-archive-'),
+            hot_blocks=args.hot_blocks,
+            segment_blocks=args.segment_blocks,
+            cache_frames=args.cache_frames,
+        )
+    baseline = memory_kb()['rss_kb']
+
+    start = perf_counter()
+    blockchain = build_chain(args.transactions, args.tx_per_block, archive)
+    build_seconds = perf_counter() - start
+    gc.collect()
+    memory = memory_kb()
+
+    # Batch ids repeat every transactions // 10 transactions, so each history
+    # spans the whole chain and mostly reads archived blocks
+    batch_count = max(1, args.transactions // 10)
+    chain = blockchain.chain
+    cold = max(1, len(chain) - args.hot_blocks)
+    history = measure(
+        blockchain.get_product_history, repeat=args.repeat,
+        setup=lambda: f'batch-{random.randrange(batch_count):08d}'
+    )
+    cold_block = measure(
+        lambda block: block.transactions, repeat=args.repeat,
+        setup=lambda: chain[random.randrange(cold)]
+    )
+
+    disk_bytes = 0
+    if archive is not None:
+        disk_bytes = sum(entry.stat().st_size for entry in os.scandir(archive.directory))
+    return {
+        'name': f'memory.{mode}',
+        'params': {
+            'transactions': args.transactions,
+            'tx_per_block': args.tx_per_block,
+            'hot_blocks': args.hot_blocks if archive is not None else None,
+            'cache_frames': args.cache_frames if archive is not None else None,
+        },
+        'blocks': len(chain),
+        'archived_blocks': len(archive) if archive is not None else 0,
+        'build_seconds': build_seconds,
+        'chain_rss_kb': memory['rss_kb'] - baseline,
+        **memory,
+        'disk_bytes': disk_bytes,
+        'history_seconds': history,
+        'cold_block_seconds': cold_block,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare chain memory with and without archival')
+    parser.add_argument('--transactions', type=int, default=10000000)
+    parser.add_argument('--tx-per-block', type=int, default=100)
+    parser.add_argument('--hot-blocks', type=int, default=10000)
+    parser.add_argument('--segment-blocks', type=int, default=1000)
+    parser.add_argument('--cache-frames', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--mode', choices=['both', 'hot', 'archived'], default='both',
+                        help='run one mode in this process instead of both in subprocesses')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='path of the JSON results file')
+    args = parser.parse_args()
+
+    if args.mode != 'both':
+        print(json.dumps(run_mode(args.mode, args)))
+        return
+
+    forwarded = [
+        '--transactions', str(args.transactions), '--tx-per-block', str(args.tx_per_block),
+        '--hot-blocks', str(args.hot_blocks), '--segment-blocks', str(args.segment_blocks),
+        '--cache-frames', str(args.cache_frames), '--repeat', str(args.repeat), '--seed', str(args.seed),
+    ]
+    results = []
+    for mode in ('hot', 'archived'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.memory_archive', '--mode', mode, *forwarded],
+            check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['name']:<18} blocks={result['blocks']:<8} rss={result['rss_kb'] / 1024:9.1f} MB "
+              f"peak={result['peak_rss_kb'] / 1024:9.1f} MB disk={result['disk_bytes'] / 2 ** 20:8.1f} MB "
+              f"history median={result['history_seconds']['median'] * 1e6:8.1f} us "
+              f"cold block median={result['cold_block_seconds']['median'] * 1e6:8.1f} us")
+        results.append(result)
+
+    print(f"Results written to {write_results('memory_archive', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
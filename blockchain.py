@@ -1,20 +1,96 @@
 import hashlib
 import json
-from time import time
+import math
+from contextlib import contextmanager
+from time import time, perf_counter
 from typing import List, Dict, Any
 import threading
 
+from archive import BlockArchive
+from chain_index import ChainIndex, ChainSnapshot
+from consensus import Consensus, ProofOfWork
+from metrics import REGISTRY
+
+MINING_ATTEMPTS = REGISTRY.histogram(
+    'ledger_block_nonce_attempts', 'Nonce attempts needed to mine a block',
+    buckets=(1, 4, 16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+)
+MINING_SECONDS = REGISTRY.histogram(
+    'ledger_block_mining_seconds', 'Wall time spent mining a block',
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+LAST_BLOCK_ATTEMPTS = REGISTRY.gauge(
+    'ledger_last_block_nonce_attempts', 'Nonce attempts needed for the most recent block'
+)
+LAST_BLOCK_SECONDS = REGISTRY.gauge(
+    'ledger_last_block_mining_seconds', 'Mining time of the most recent block'
+)
+LOCK_WAIT = REGISTRY.histogram(
+    'ledger_lock_wait_seconds', 'Time spent waiting to acquire Blockchain._lock', ('operation',),
+    buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+)
+
+# Fixed so that every node builds the same genesis block and replication can
+# check that two chains share their first block
+GENESIS_TIMESTAMP = 0.0
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _check_block_shape(data) -> None:
+    """Reject peer data that would fail later, while the block is committed"""
+    if not isinstance(data, dict):
+        raise ValueError(f'Block must be an object, got {type(data).__name__}')
+    if not isinstance(data.get('index'), int) or isinstance(data['index'], bool) or data['index'] < 0:
+        raise ValueError('Block index must be a non-negative integer')
+    for field in ('hash', 'previous_hash', 'merkle_root'):
+        if not isinstance(data.get(field), str):
+            raise ValueError(f'Block {field} must be a string')
+    if not _is_number(data.get('timestamp')) or not isinstance(data.get('nonce'), int):
+        raise ValueError('Block timestamp and nonce must be numbers')
+    transactions = data.get('transactions')
+    if not isinstance(transactions, list):
+        raise ValueError('Block transactions must be a list')
+    for position, tx in enumerate(transactions):
+        if not isinstance(tx, dict) or not isinstance(tx.get('hash'), str):
+            raise ValueError(f'Transaction {position} of block {data["index"]} has no hash')
+        if not isinstance(tx.get('batch_id'), (str, int, type(None))):
+            raise ValueError(f'Transaction {position} of block {data["index"]} has an invalid batch_id')
+        if 'timestamp' in tx and not _is_number(tx['timestamp']):
+            raise ValueError(f'Transaction {position} of block {data["index"]} has an invalid timestamp')
+
+
 class Block:
     def __init__(self, index: int, transactions: List[Dict], timestamp: float, previous_hash: str):
         self.index = index
-        self.transactions = transactions
+        self._transactions = transactions
+        self._archive = None  # Holds the body once it has been archived
         self.timestamp = timestamp
         self.previous_hash = previous_hash
         self.nonce = 0
+        self.signer = None  # Set by authority consensus
+        self.signature = None
         self.merkle_root = self.calculate_merkle_root()
         self.hash = self.calculate_hash()
         self._locked = False  # Internal lock flag
 
+    @property
+    def transactions(self) -> List[Dict]:
+        transactions = self._transactions
+        if transactions is None:
+            return self._archive.load(self.hash)
+        return transactions
+
+    def release_transactions(self, archive) -> None:
+        """Drop the in-memory body of a block that archive now holds.
+
+        The block's content does not change, only where it is stored, so this
+        is allowed on locked blocks.
+        """
+        object.__setattr__(self, '_archive', archive)
+        object.__setattr__(self, '_transactions', None)
+
     def calculate_merkle_root(self) -> str:
         if not self.transactions:
             return hashlib.sha256("empty".encode()).hexdigest()
@@ -46,6 +122,45 @@ class Block:
         block_string = json.dumps(block_data, sort_keys=True)
         return hashlib.sha256(block_string.encode()).hexdigest()
 
+    def to_dict(self) -> Dict[str, Any]:
+        block_data = {
+            'index': self.index,
+            'transactions': self.transactions,
+            'timestamp': self.timestamp,
+            'previous_hash': self.previous_hash,
+            'hash': self.hash,
+            'nonce': self.nonce,
+            'merkle_root': self.merkle_root
+        }
+        if self.signature is not None:
+            block_data['signer'] = self.signer
+            block_data['signature'] = self.signature
+        return block_data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Block':
+        """Rebuild a locked block received from a peer.
+
+        Raises ValueError if the block or one of its transactions does not
+        have the expected shape. Hashes are taken as sent; callers validate
+        them before trusting the block.
+        """
+        _check_block_shape(data)
+        block = cls.__new__(cls)
+        block.index = data['index']
+        block._transactions = data['transactions']
+        block._archive = None
+        block.timestamp = data['timestamp']
+        block.previous_hash = data['previous_hash']
+        block.nonce = data['nonce']
+        block.signer = data.get('signer')
+        block.signature = data.get('signature')
+        block.merkle_root = data['merkle_root']
+        block.hash = data['hash']
+        block._locked = False
+        block.lock()
+        return block
+
     def lock(self):
         """Once a block is locked, its content cannot be modified"""
         self._locked = True
@@ -57,120 +172,321 @@ class Block:
         super().__setattr__(name, value)
 
 class Blockchain:
-    def __init__(self):
+    """Append-only ledger of supply-chain transactions.
+
+    Writers (add_transaction, block commits, fork resolution) serialize on
+    _lock and hold it only for short bookkeeping. Sealing a block happens
+    outside the lock, and readers use the immutable ChainSnapshot returned by
+    snapshot(), so history and verification lookups never wait on mining.
+
+    With an archive, the transaction bodies of blocks more than
+    archive.hot_blocks behind the tip are moved to disk after each commit.
+    """
+
+    def __init__(self, consensus: Consensus = None, archive: BlockArchive = None):
         self.chain: List[Block] = []
         self.pending_transactions: List[Dict] = []
-        self.difficulty = 4
+        self.consensus = consensus or ProofOfWork(difficulty=4)
         self._lock = threading.Lock()  # Thread safety
+        self._mining_lock = threading.Lock()  # One block is sealed at a time
         self._chain_hash = None  # Full chain hash
+        self._index = ChainIndex()
+        self._snapshot: ChainSnapshot = None
+        self.archive = archive
+        self._archived_height = 0  # Blocks below this height have been archived
+        self._archive_lock = threading.Lock()
         
         # Create genesis block
         self.create_genesis_block()
 
+    @property
+    def difficulty(self) -> int:
+        """Proof-of-work difficulty; 0 when the chain does not use PoW"""
+        return getattr(self.consensus, 'difficulty', 0)
+
+    @difficulty.setter
+    def difficulty(self, value: int):
+        if not isinstance(self.consensus, ProofOfWork):
+            raise ValueError(f'{self.consensus.name} consensus has no difficulty')
+        self.consensus.difficulty = value
+
     def create_genesis_block(self):
-        genesis_block = Block(0, [], time(), "0")
-        self._mine_block(genesis_block)
+        genesis_block = Block(0, [], GENESIS_TIMESTAMP, "0")
+        # The genesis block is never validated, so verify-only authority
+        # nodes leave it unsealed
+        if self.consensus.can_seal:
+            self._mine_block(genesis_block)
         genesis_block.lock()
-        self.chain.append(genesis_block)
-        self._update_chain_hash()
+        with self._locked('create_genesis_block'):
+            self._commit_blocks([genesis_block])
 
     def _mine_block(self, block: Block) -> None:
-        """Mine a block with proof of work"""
-        while not block.hash.startswith('0' * self.difficulty):
-            block.nonce += 1
-            block.hash = block.calculate_hash()
-
-    def _update_chain_hash(self):
-        """Update the hash of the entire chain"""
-        chain_data = [block.hash for block in self.chain]
-        self._chain_hash = hashlib.sha256(
-            json.dumps(chain_data).encode()
-        ).hexdigest()
+        """Seal a block according to the chain's consensus"""
+        start = perf_counter()
+        first_nonce = block.nonce
+        self.consensus.seal(block)
+
+        elapsed = perf_counter() - start
+        attempts = block.nonce - first_nonce + 1
+        MINING_ATTEMPTS.observe(attempts)
+        MINING_SECONDS.observe(elapsed)
+        LAST_BLOCK_ATTEMPTS.set(attempts)
+        LAST_BLOCK_SECONDS.set(elapsed)
 
-    def add_transaction(self, transaction: Dict[str, Any]):
-        """Add a new transaction to pending transactions"""
+    @contextmanager
+    def _locked(self, operation: str):
+        """Acquire the chain lock, recording how long the caller waited"""
+        start = perf_counter()
         with self._lock:
+            LOCK_WAIT.observe(perf_counter() - start, operation=operation)
+            yield
+
+    def _update_chain_hash(self, blocks: List[Block]):
+        """Fold newly appended blocks into the hash of the entire chain"""
+        for block in blocks:
+            self._chain_hash = hashlib.sha256(
+                json.dumps([self._chain_hash, block.hash]).encode()
+            ).hexdigest()
+
+    def _commit_blocks(self, blocks: List[Block]) -> None:
+        """Append validated blocks and publish a new snapshot; caller holds _lock.
+
+        Index entries for every block are prepared first, so a block that
+        cannot be indexed raises before the chain or the index change.
+        """
+        prepared = [(block, ChainIndex.prepare_block(block)) for block in blocks]
+        for block, entries in prepared:
+            self.chain.append(block)
+            self._index.apply_block(block, entries)
+        self._update_chain_hash(blocks)
+        self._snapshot = ChainSnapshot(self.chain, self._index, len(self.chain))
+
+    def snapshot(self) -> ChainSnapshot:
+        """The latest committed state; safe to read without any lock"""
+        return self._snapshot
+
+    def archive_cold_blocks(self) -> int:
+        """Archive whole segments of blocks that have left the hot window.
+
+        Runs outside _lock: segments are written first, and bodies are dropped
+        only after that, so readers always find a block's transactions in one
+        place or the other. Returns the number of blocks archived, and 0
+        straight away if another thread is already archiving.
+        """
+        if self.archive is None or not self._archive_lock.acquire(blocking=False):
+            return 0
+        archived = 0
+        try:
+            while True:
+                with self._locked('archive_cold_blocks'):
+                    chain, start = self.chain, self._archived_height
+                if len(chain) - self.archive.hot_blocks - start < self.archive.segment_blocks:
+                    return archived
+                end = start + self.archive.segment_blocks
+                self.archive.store(chain[start:end])
+                with self._locked('archive_cold_blocks'):
+                    # A fork resolution swapped the chain; its blocks start hot
+                    if self.chain is not chain:
+                        return archived
+                    self._archived_height = end
+                archived += end - start
+        finally:
+            self._archive_lock.release()
+
+    def add_transaction(self, transaction: Dict[str, Any]) -> str:
+        """Add a new transaction to pending transactions; returns its hash"""
+        transaction_hash = hashlib.sha256(
+            json.dumps(transaction, sort_keys=True).encode()
+        ).hexdigest()
+        with self._locked('add_transaction'):
             self.pending_transactions.append({
                 **transaction,
                 'timestamp': time(),
-                'hash': hashlib.sha256(
-                    json.dumps(transaction, sort_keys=True).encode()
-                ).hexdigest()
+                'hash': transaction_hash
             })
+        return transaction_hash
 
     def mine_pending_transactions(self) -> Block:
-        """Mine pending transactions into a new block"""
-        with self._lock:
-            if not self.pending_transactions:
-                return None
-
-            last_block = self.chain[-1]
-            new_block = Block(
-                index=last_block.index + 1,
-                transactions=self.pending_transactions.copy(),
-                timestamp=time(),
-                previous_hash=last_block.hash
-            )
-
-            self._mine_block(new_block)
-            new_block.lock()  # Lock the block after mining
-            self.chain.append(new_block)
-            self._update_chain_hash()
-            self.pending_transactions = []
-            
-            return new_block
+        """Mine pending transactions into a new block.
 
-    def is_chain_valid(self) -> bool:
-        """Validate the entire blockchain"""
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i-1]
+        The candidate block is sealed outside _lock. If a peer sync moves the
+        tip in the meantime, the block is rebuilt on the new tip with the
+        transactions the new chain does not already contain.
+        """
+        if not self.consensus.can_seal:
+            raise RuntimeError(f'This node cannot seal {self.consensus.name} blocks')
+        with self._mining_lock:
+            with self._locked('take_pending_transactions'):
+                if not self.pending_transactions:
+                    return None
+                transactions = self.pending_transactions
+                self.pending_transactions = []
+                last_block = self.chain[-1]
 
-            # Verify current block hash
-            if current_block.hash != current_block.calculate_hash():
-                return False
+            while True:
+                new_block = Block(
+                    index=last_block.index + 1,
+                    transactions=transactions,
+                    timestamp=time(),
+                    previous_hash=last_block.hash
+                )
+                try:
+                    self._mine_block(new_block)
+                    new_block.lock()  # Lock the block after mining
 
-            # Verify chain linkage
-            if current_block.previous_hash != previous_block.hash:
-                return False
+                    with self._locked('commit_block'):
+                        committed = self.chain[-1] is last_block
+                        if committed:
+                            self._commit_blocks([new_block])
+                        snapshot = self._snapshot
+                        last_block = self.chain[-1]
+                except BaseException:
+                    # Nothing was committed; give the transactions back
+                    with self._locked('restore_pending_transactions'):
+                        self.pending_transactions = transactions + self.pending_transactions
+                    raise
+                if committed:
+                    self.archive_cold_blocks()
+                    return new_block
+
+                transactions = [
+                    tx for tx in transactions if not snapshot.verify_transaction(tx['hash'])
+                ]
+                if not transactions:
+                    return None
+
+    def _is_block_valid(self, current_block: Block, previous_block: Block) -> bool:
+        """Validate a single block against its predecessor"""
+        # Verify position in the chain
+        if current_block.index != previous_block.index + 1:
+            return False
+
+        # Verify current block hash
+        if current_block.hash != current_block.calculate_hash():
+            return False
 
-            # Verify merkle root
-            if current_block.merkle_root != current_block.calculate_merkle_root():
+        # Verify chain linkage
+        if current_block.previous_hash != previous_block.hash:
+            return False
+
+        # Verify merkle root
+        if current_block.merkle_root != current_block.calculate_merkle_root():
+            return False
+
+        # Verify proof of work or authority signature
+        return self.consensus.verify(current_block)
+
+    def _are_blocks_valid(self, blocks: List[Block], previous_block: Block) -> bool:
+        for block in blocks:
+            if not self._is_block_valid(block, previous_block):
                 return False
+            previous_block = block
+        return True
+
+    def is_chain_valid(self, full: bool = False) -> bool:
+        """Validate the blockchain.
+
+        Archived blocks were validated when they were committed, and
+        re-hashing them would decompress every segment and flush the frame
+        cache, so by default only the hot blocks are checked, linked to the
+        last archived header. Pass full=True to re-check every block.
+        """
+        blocks = self._snapshot.blocks
+        start = 0 if full else max(min(self._archived_height, len(blocks)) - 1, 0)
+        return self._are_blocks_valid(blocks[start + 1:], blocks[start])
+
+    @property
+    def height(self) -> int:
+        """Number of blocks in the chain, including genesis"""
+        return self._snapshot.height
 
-            # Verify proof of work
-            if not current_block.hash.startswith('0' * self.difficulty):
+    def blocks_from(self, height: int, limit: int = None) -> List[Block]:
+        """Blocks with index >= height, oldest first"""
+        return self._snapshot.blocks_from(height, limit)
+
+    def append_blocks(self, blocks: List[Block]) -> bool:
+        """Append blocks that extend the current tip, validating only the new blocks"""
+        if not blocks:
+            return True
+        tip = self._snapshot.tip
+        if not self._are_blocks_valid(blocks, tip):
+            return False
+        with self._locked('append_blocks'):
+            # A local block landed while we validated; the caller will retry
+            if self.chain[-1] is not tip:
                 return False
+            self._commit_blocks(blocks)
+            self._drop_confirmed_pending(blocks)
+        self.archive_cold_blocks()
+        return True
 
+    def replace_chain(self, blocks: List[Block]) -> bool:
+        """Adopt a competing chain if it is longer than ours and fully valid"""
+        if len(blocks) <= self.height:
+            return False
+        genesis = self.chain[0]
+        # Chains with a different genesis are a different ledger, not a fork
+        if blocks[0].index != 0 or blocks[0].hash != genesis.hash:
+            return False
+        # Keep our own genesis object; the peer's copy was never validated
+        blocks = [genesis, *blocks[1:]]
+        if not self._are_blocks_valid(blocks[1:], genesis):
+            return False
+        index = ChainIndex.build(blocks)
+        with self._locked('replace_chain'):
+            # Another sync may have grown the chain while we validated
+            if len(blocks) <= len(self.chain):
+                return False
+            # Blocks both chains share are skipped, so archived bodies of the
+            # common prefix are not read back
+            orphaned = [
+                tx for block in self.chain[1:] if block.hash not in index.block_heights
+                for tx in block.transactions
+            ]
+            # Swap in fresh objects so existing snapshots keep the old chain
+            self.chain = list(blocks)
+            self._index = index
+            self._chain_hash = None
+            self._update_chain_hash(self.chain)
+            self._snapshot = ChainSnapshot(self.chain, self._index, len(self.chain))
+            self._archived_height = 0
+            # Transactions only the losing fork had go back to the queue
+            self.pending_transactions = orphaned + self.pending_transactions
+            self._drop_confirmed_pending(blocks)
+        self.archive_cold_blocks()
         return True
 
+    def _drop_confirmed_pending(self, blocks: List[Block]) -> None:
+        """Forget pending transactions that are already in the given blocks"""
+        if not self.pending_transactions:
+            return
+        confirmed = {tx['hash'] for block in blocks for tx in block.transactions}
+        self.pending_transactions = [
+            tx for tx in self.pending_transactions if tx['hash'] not in confirmed
+        ]
+
     def verify_transaction(self, transaction_hash: str) -> bool:
         """Verify if a transaction exists in the blockchain"""
-        for block in self.chain:
-            for transaction in block.transactions:
-                if transaction['hash'] == transaction_hash:
-                    return True
-        return False
+        return self._snapshot.verify_transaction(transaction_hash)
+
+    def get_product_history(self, batch_id: str) -> List[Dict]:
+        """All transactions recorded for a batch, oldest first"""
+        return self._snapshot.get_product_history(batch_id)
+
+    def query_transactions(self, filters: Dict[str, str], since: float = None, until: float = None,
+                           cursor: int = None, limit: int = 100):
+        """Page of transactions matching the indexed filters, in timestamp order"""
+        return self._snapshot.query_transactions(filters, since, until, cursor, limit)
+
+    def get_transaction_block(self, transaction_hash: str) -> Block:
+        """The committed block holding a transaction, or None"""
+        return self._snapshot.get_transaction_block(transaction_hash)
 
     def get_block_by_hash(self, block_hash: str) -> Block:
         """Retrieve a block by its hash"""
-        for block in self.chain:
-            if block.hash == block_hash:
-                return block
-        return None
+        return self._snapshot.get_block_by_hash(block_hash)
 
     def export_chain(self) -> str:
         """Export the entire blockchain as a JSON string"""
-        chain_data = []
-        for block in self.chain:
-            block_data = {
-                'index': block.index,
-                'transactions': block.transactions,
-                'timestamp': block.timestamp,
-                'previous_hash': block.previous_hash,
-                'hash': block.hash,
-                'nonce': block.nonce,
-                'merkle_root': block.merkle_root
-            }
-            chain_data.append(block_data)
+        chain_data = [block.to_dict() for block in self._snapshot.blocks]
         return json.dumps(chain_data, indent=2)
\ No newline at end of file
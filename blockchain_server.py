@@ -1,31 +1,90 @@
 from flask import Flask, jsonify, request
+from archive import BlockArchive, archive_from_env
 from blockchain import Blockchain
-from typing import Dict, Any
+from chain_index import INDEXED_FIELDS
+from consensus import Consensus, consensus_from_env
+from metrics import Registry, instrument_app
+from profiling import install_profiler
+from replication import PeerSync
+from typing import Dict, Any, List
+import argparse
+import hmac
 import json
+import math
+import os
 from time import time
 
+def _query_arg(name: str, convert, description: str):
+    """Parse an optional query parameter, raising ValueError for malformed values"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        parsed = convert(value)
+    except ValueError:
+        raise ValueError(f'{name} must be {description}, got {value!r}') from None
+    if not math.isfinite(parsed):
+        raise ValueError(f'{name} must be finite')
+    return parsed
+
 class BlockchainServer:
-    def __init__(self, host='0.0.0.0', port=5000):
+    def __init__(self, host='0.0.0.0', port=5000, consensus: Consensus = None,
+                 role='leader', peers: List[str] = (), leader: str = None, sync_interval: float = 0,
+                 archive: BlockArchive = None, peer_token: str = None):
+        if role not in ('leader', 'follower'):
+            raise ValueError(f'Unknown role {role!r}')
         self.app = Flask(__name__)
-        self.blockchain = Blockchain()
+        # Merkle roots hash transactions in insertion order, so blocks sent to
+        # peers must keep their key order
+        self.app.json.sort_keys = False
+        self.blockchain = Blockchain(
+            consensus or consensus_from_env(),
+            archive if archive is not None else archive_from_env()
+        )
         self.host = host
         self.port = port
+        self.role = role
+        self.sync_interval = sync_interval
+        # Shared secret for the peer admin routes; without one they are disabled
+        # and the node only syncs with peers given on the command line
+        self.peer_token = peer_token if peer_token is not None else os.environ.get('LEDGER_PEER_TOKEN')
+        self.peer_sync = PeerSync(self.blockchain, peers)
+        # Followers are read replicas that pull from the leader
+        self.leader = self.peer_sync.register(leader) if leader else None
 
         # Register routes
         self.register_routes()
+        self.register_metrics()
+
+    def _peer_admin_error(self):
+        """Error response unless the request carries the peer token"""
+        if not self.peer_token:
+            return jsonify({'error': 'Peer administration is disabled; set LEDGER_PEER_TOKEN'}), 403
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {self.peer_token}'.encode()):
+            return jsonify({'error': 'Missing or invalid peer token'}), 401
+        return None
 
     def register_routes(self):
         @self.app.route('/add_transaction', methods=['POST'])
         def add_transaction():
+            if self.role == 'follower':
+                return jsonify({
+                    'error': 'This node is a read replica; send writes to the leader',
+                    'leader': self.leader
+                }), 403
             try:
                 transaction_data = request.get_json()
                 
                 # Add transaction to pending
-                self.blockchain.add_transaction(transaction_data)
+                transaction_hash = self.blockchain.add_transaction(transaction_data)
                 
                 # Mine block with pending transactions
-                block = self.blockchain.mine_pending_transactions()
-                
+                self.blockchain.mine_pending_transactions()
+
+                # A concurrent request may have sealed this transaction into
+                # its own block, so report whichever block holds it
+                block = self.blockchain.get_transaction_block(transaction_hash)
                 if block:
                     response = {
                         'message': 'Transaction added successfully',
@@ -34,7 +93,7 @@ class BlockchainServer:
                     }
                     return jsonify(response), 200
                 else:
-                    return jsonify({'message': 'No transactions to mine'}), 400
+                    return jsonify({'message': 'Transaction was not mined'}), 400
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
 
@@ -45,13 +104,43 @@ class BlockchainServer:
 
         @self.app.route('/get_product_history/<batch_id>', methods=['GET'])
         def get_product_history(batch_id):
-            transactions = []
-            for block in self.blockchain.chain:
-                for tx in block.transactions:
-                    if tx.get('batch_id') == batch_id:
-                        transactions.append(tx)
+            transactions = self.blockchain.get_product_history(batch_id)
             return jsonify(transactions), 200
 
+        @self.app.route('/batch_status', methods=['POST'])
+        def batch_status():
+            batch_ids = (request.get_json(silent=True) or {}).get('batch_ids')
+            if not isinstance(batch_ids, list) or len(batch_ids) > 10000:
+                return jsonify({'error': 'Expected "batch_ids" as a list of at most 10000 ids'}), 400
+            snapshot = self.blockchain.snapshot()
+            return jsonify({
+                'height': snapshot.height,
+                'batches': snapshot.get_batch_statuses([str(batch_id) for batch_id in batch_ids])
+            }), 200
+
+        @self.app.route('/transactions', methods=['GET'])
+        def query_transactions():
+            filters = {field: request.args[field] for field in INDEXED_FIELDS if field in request.args}
+            try:
+                # request.args.get(type=...) would silently drop malformed values
+                since = _query_arg('since', float, 'a number')
+                until = _query_arg('until', float, 'a number')
+                cursor = _query_arg('cursor', int, 'an integer')
+                limit = _query_arg('limit', int, 'an integer')
+                limit = 100 if limit is None else limit
+                if not 1 <= limit <= 1000:
+                    raise ValueError('limit must be between 1 and 1000')
+                snapshot = self.blockchain.snapshot()
+                transactions, next_cursor = snapshot.query_transactions(filters, since, until, cursor, limit)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            return jsonify({
+                'transactions': transactions,
+                'next_cursor': None if next_cursor is None else str(next_cursor),
+                'height': snapshot.height
+            }), 200
+
         @self.app.route('/verify_transaction/<transaction_hash>', methods=['GET'])
         def verify_transaction(transaction_hash):
             is_valid = self.blockchain.verify_transaction(transaction_hash)
@@ -60,14 +149,90 @@ class BlockchainServer:
         @self.app.route('/chain_status', methods=['GET'])
         def chain_status():
             return jsonify({
-                'length': len(self.blockchain.chain),
+                'length': self.blockchain.height,
+                'consensus': self.blockchain.consensus.name,
                 'is_valid': self.blockchain.is_chain_valid(),
-                'pending_transactions': len(self.blockchain.pending_transactions)
+                'pending_transactions': len(self.blockchain.pending_transactions),
+                'archived_blocks': len(self.blockchain.archive) if self.blockchain.archive is not None else 0,
+                'role': self.role,
+                'peers': sorted(self.peer_sync.peers)
+            }), 200
+
+        @self.app.route('/blocks', methods=['GET'])
+        def get_blocks():
+            from_height = request.args.get('from_height', 0, type=int)
+            limit = min(request.args.get('limit', 500, type=int), 5000)
+            blocks = self.blockchain.blocks_from(max(from_height, 0), limit)
+            return jsonify({
+                'height': self.blockchain.height,
+                'blocks': [block.to_dict() for block in blocks]
             }), 200
 
+        @self.app.route('/peers', methods=['GET'])
+        def get_peers():
+            return jsonify({'peers': sorted(self.peer_sync.peers)}), 200
+
+        @self.app.route('/peers/register', methods=['POST'])
+        def register_peers():
+            error = self._peer_admin_error()
+            if error:
+                return error
+            data = request.get_json() or {}
+            addresses = data.get('addresses') or ([data['address']] if data.get('address') else [])
+            if not addresses:
+                return jsonify({'error': 'Provide "address" or "addresses"'}), 400
+            for address in addresses:
+                self.peer_sync.register(address)
+            return jsonify({'peers': sorted(self.peer_sync.peers)}), 200
+
+        @self.app.route('/sync', methods=['POST'])
+        def sync():
+            error = self._peer_admin_error()
+            if error:
+                return error
+            return jsonify(self.peer_sync.sync()), 200
+
+    def register_metrics(self):
+        # Queue depth and height describe this node, so they live in a registry
+        # of its own instead of the process-wide one other nodes also report
+        self.metrics = Registry()
+        self.metrics.gauge(
+            'ledger_pending_transactions', 'Transactions waiting to be mined'
+        ).set_function(lambda: len(self.blockchain.pending_transactions))
+        self.metrics.gauge(
+            'ledger_chain_length', 'Number of blocks in the chain'
+        ).set_function(lambda: self.blockchain.height)
+        instrument_app(self.app, local=self.metrics)
+        install_profiler(self.app)
+
     def run(self):
+        if self.sync_interval > 0 and self.peer_sync.peers:
+            self.peer_sync.start(self.sync_interval)
         self.app.run(host=self.host, port=self.port)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='MediLedger blockchain node')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--role', choices=['leader', 'follower'], default='leader',
+                        help='followers are read replicas that reject writes')
+    parser.add_argument('--leader', help='leader URL a follower pulls blocks from')
+    parser.add_argument('--peers', nargs='*', default=[], help='peer URLs to sync with')
+    parser.add_argument('--sync-interval', type=float, default=None,
+                        help='seconds between background syncs (default 2 for followers, off for leaders)')
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    blockchain_server = BlockchainServer()
+    args = parse_args()
+    sync_interval = args.sync_interval
+    if sync_interval is None:
+        sync_interval = 2.0 if args.role == 'follower' else 0
+    blockchain_server = BlockchainServer(
+        host=args.host,
+        port=args.port,
+        role=args.role,
+        peers=args.peers,
+        leader=args.leader,
+        sync_interval=sync_interval
+    )
     blockchain_server.run()
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""Append-only lookup indexes over the blocks of a chain, and read snapshots.
+
+ChainIndex is only ever appended to, under Blockchain._lock. A ChainSnapshot
+pins a height and ignores index entries at or above it. Readers can
+therefore use the shared lists and dicts while a writer keeps appending,
+without taking any lock. When a fork is resolved, the chain gets a new
+index object, and snapshots taken before the swap keep the old one.
+"""
+import sys
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+Location = Tuple[int, int]  # (block index, position in block)
+TimeKey = Tuple[float, int]  # (timestamp, sequence number)
+
+# Transaction fields with a secondary index usable by query()
+INDEXED_FIELDS = ('type', 'updated_by', 'status')
+
+
+def _merge_sorted(entries: Optional[List[TimeKey]], keys: List[TimeKey]) -> List[TimeKey]:
+    """Add one block's sorted keys to a time-ordered posting list without disturbing readers.
+
+    Keys nearly always arrive in order and are appended in place. If some
+    arrive out of order (for example from a peer's clock, or orphaned
+    transactions mined again), a merged copy is returned instead, because
+    an in-place insert would shift entries under a concurrent reader. That
+    costs one copy of the list per block, not one per transaction.
+    """
+    if entries is None:
+        return keys
+    if not entries or entries[-1] <= keys[0]:
+        entries.extend(keys)
+        return entries
+    # Copy the runs between insertion points whole instead of comparing
+    # every entry of the list
+    merged: List[TimeKey] = []
+    previous = 0
+    for key in keys:
+        position = bisect_right(entries, key, previous)
+        merged += entries[previous:position]
+        merged.append(key)
+        previous = position
+    merged += entries[previous:]
+    return merged
+
+
+class ChainIndex:
+    def __init__(self):
+        self.tx_locations: Dict[str, Location] = {}
+        self.batch_locations: Dict[str, List[Location]] = {}
+        self.block_heights: Dict[str, int] = {}
+
+        # Every transaction gets a sequence number in chain order
+        self.seq_locations: List[Location] = []
+        self.seq_timestamps: List[float] = []
+        self.seq_fields: List[Tuple[Optional[str], ...]] = []
+        self.by_time: List[TimeKey] = []
+        self.by_field: Dict[str, Dict[str, List[TimeKey]]] = {field: {} for field in INDEXED_FIELDS}
+
+    def add_block(self, block) -> None:
+        self.apply_block(block, self.prepare_block(block))
+
+    @staticmethod
+    def prepare_block(block) -> List[Tuple]:
+        """Work out a block's index entries without touching the index.
+
+        Anything about a transaction that can make indexing fail raises here,
+        so a caller can prepare every block before it commits any of them.
+        """
+        entries = []
+        for position, tx in enumerate(block.transactions):
+            tx_hash = tx['hash']
+            batch_id = tx.get('batch_id')
+            hash(tx_hash), hash(batch_id)  # Both become dict keys
+            timestamp = tx.get('timestamp')
+            if not isinstance(timestamp, (int, float)):
+                timestamp = block.timestamp
+            # Field values repeat heavily; interning keeps one copy of each, which
+            # matters once archived blocks leave only the index in memory
+            fields = tuple(None if tx.get(field) is None else sys.intern(str(tx[field])) for field in INDEXED_FIELDS)
+            entries.append(((block.index, position), tx_hash, batch_id, timestamp, fields))
+        return entries
+
+    def apply_block(self, block, entries: List[Tuple]) -> None:
+        """Add the entries from prepare_block(); cannot fail part way"""
+        time_keys: List[TimeKey] = []
+        field_keys: Dict[Tuple[str, str], List[TimeKey]] = {}
+        for location, tx_hash, batch_id, timestamp, fields in entries:
+            self.tx_locations.setdefault(tx_hash, location)
+            if batch_id is not None:
+                self.batch_locations.setdefault(batch_id, []).append(location)
+
+            key = (timestamp, len(self.seq_locations))
+            self.seq_locations.append(location)
+            self.seq_timestamps.append(timestamp)
+            self.seq_fields.append(fields)
+            time_keys.append(key)
+            for field, value in zip(INDEXED_FIELDS, fields):
+                if value is not None:
+                    field_keys.setdefault((field, value), []).append(key)
+
+        if time_keys:
+            self.by_time = _merge_sorted(self.by_time, sorted(time_keys))
+        for (field, value), keys in field_keys.items():
+            postings = self.by_field[field]
+            postings[value] = _merge_sorted(postings.get(value), sorted(keys))
+        self.block_heights[block.hash] = block.index
+
+    def query(self, filters: Dict[str, str], since: float = None, until: float = None,
+              after: int = None, limit: int = 100, tx_count: int = None) -> Tuple[List[int], Optional[int]]:
+        """Sequence numbers of matching transactions in timestamp order.
+
+        Walks the shortest posting list in the requested time window and
+        checks the remaining filters against the stored field values, so
+        the cost grows with the size of the most selective filter rather than
+        with the chain. `after` is the cursor returned by the previous page;
+        a cursor outside the snapshot raises ValueError. Entries at or beyond
+        tx_count (a snapshot's size) are ignored.
+        """
+        tx_count = len(self.seq_locations) if tx_count is None else tx_count
+        unknown = set(filters) - set(INDEXED_FIELDS)
+        if unknown:
+            raise ValueError(f'Cannot filter on {sorted(unknown)}; indexed fields are {list(INDEXED_FIELDS)}')
+
+        lower: TimeKey = (float('-inf'), -1) if since is None else (since, -1)
+        if after is not None:
+            # Restarting from the first page would make a paginating client loop
+            if not 0 <= after < tx_count:
+                raise ValueError(f'Cursor {after} does not belong to this chain')
+            lower = max(lower, (self.seq_timestamps[after], after))
+        upper: TimeKey = (float('inf'), 0) if until is None else (until, float('inf'))
+
+        candidates = [self.by_time]
+        if filters:
+            candidates = [self.by_field[field].get(str(value), []) for field, value in filters.items()]
+        ranges = [(entries, bisect_right(entries, lower), bisect_left(entries, upper)) for entries in candidates]
+        entries, start, end = min(ranges, key=lambda r: r[2] - r[1])
+
+        checks = [(INDEXED_FIELDS.index(field), str(value)) for field, value in filters.items()]
+        matches: List[int] = []
+        for position in range(start, end):
+            seq = entries[position][1]
+            if seq >= tx_count:
+                continue
+            fields = self.seq_fields[seq]
+            if all(fields[i] == value for i, value in checks):
+                matches.append(seq)
+                if len(matches) == limit:
+                    # Only hand out a cursor if there may be more results
+                    return matches, (seq if position + 1 < end else None)
+        return matches, None
+
+    @classmethod
+    def build(cls, blocks) -> 'ChainIndex':
+        index = cls()
+        for block in blocks:
+            index.add_block(block)
+        return index
+
+
+class ChainSnapshot:
+    """Immutable view of the chain as of one height"""
+
+    __slots__ = ('height', 'tip', 'tx_count', '_blocks', '_index')
+
+    def __init__(self, blocks: List, index: ChainIndex, height: int):
+        self._blocks = blocks
+        self._index = index
+        self.height = height
+        self.tip = blocks[height - 1]
+        self.tx_count = len(index.seq_locations)
+
+    @property
+    def blocks(self) -> List:
+        return self._blocks[:self.height]
+
+    def blocks_from(self, height: int, limit: int = None) -> List:
+        end = self.height if limit is None else min(self.height, height + limit)
+        return self._blocks[height:end]
+
+    def get_transaction(self, location: Location) -> Dict:
+        block_index, position = location
+        return self._blocks[block_index].transactions[position]
+
+    def verify_transaction(self, transaction_hash: str) -> bool:
+        location = self._index.tx_locations.get(transaction_hash)
+        return location is not None and location[0] < self.height
+
+    def get_transaction_block(self, transaction_hash: str) -> Optional[object]:
+        location = self._index.tx_locations.get(transaction_hash)
+        if location is None or location[0] >= self.height:
+            return None
+        return self._blocks[location[0]]
+
+    def get_product_history(self, batch_id: str) -> List[Dict]:
+        locations = self._index.batch_locations.get(batch_id, ())
+        return [self.get_transaction(location) for location in locations if location[0] < self.height]
+
+    def get_batch_statuses(self, batch_ids: List[str]) -> Dict[str, Dict]:
+        """Chain confirmation and latest event for many batches in one pass over the index"""
+        statuses = {}
+        for batch_id in batch_ids:
+            locations = [
+                location for location in self._index.batch_locations.get(batch_id, ())
+                if location[0] < self.height
+            ]
+            if not locations:
+                statuses[batch_id] = {'confirmed': False, 'transaction_count': 0}
+                continue
+            latest = self.get_transaction(locations[-1])
+            statuses[batch_id] = {
+                'confirmed': True,
+                'transaction_count': len(locations),
+                'first_block': locations[0][0],
+                'latest_type': latest.get('type'),
+                'latest_status': latest.get('status'),
+                'latest_timestamp': latest.get('timestamp'),
+            }
+        return statuses
+
+    def get_block_by_hash(self, block_hash: str) -> Optional[object]:
+        height = self._index.block_heights.get(block_hash)
+        if height is None or height >= self.height:
+            return None
+        return self._blocks[height]
+
+    def query_transactions(self, filters: Dict[str, str], since: float = None, until: float = None,
+                           cursor: int = None, limit: int = 100) -> Tuple[List[Dict], Optional[int]]:
+        """Transactions matching all filters, in timestamp order, one page at a time"""
+        seqs, next_cursor = self._index.query(filters, since, until, cursor, limit, self.tx_count)
+        locations = self._index.seq_locations
+        return [self.get_transaction(locations[seq]) for seq in seqs], next_cursor
@@ -0,0 +1,162 @@
+"""Consensus rules used by Blockchain to seal and validate blocks.
+
+ProofOfWork is the original mining behaviour. AuthorityConsensus is meant for
+permissioned deployments where every node is known up front: blocks are
+sealed by signing the block hash with a configured key, so sealing costs one
+signature instead of a nonce search.
+"""
+import hashlib
+import hmac
+import os
+from typing import Dict, Optional
+
+
+class Consensus:
+    name = 'base'
+
+    @property
+    def can_seal(self) -> bool:
+        """Whether this node is able to produce new blocks"""
+        return True
+
+    def seal(self, block) -> None:
+        """Make the block acceptable under this consensus; called before lock()"""
+        raise NotImplementedError
+
+    def verify(self, block) -> bool:
+        """Check the seal of a block whose hash has already been verified"""
+        raise NotImplementedError
+
+
+class ProofOfWork(Consensus):
+    name = 'pow'
+
+    def __init__(self, difficulty: int = 4):
+        self.difficulty = difficulty
+
+    def seal(self, block) -> None:
+        while not block.hash.startswith('0' * self.difficulty):
+            block.nonce += 1
+            block.hash = block.calculate_hash()
+
+    def verify(self, block) -> bool:
+        return block.hash.startswith('0' * self.difficulty)
+
+
+class HmacKey:
+    """Shared-secret key; every node holding it can both seal and verify"""
+
+    def __init__(self, secret: bytes):
+        self.secret = secret
+
+    @property
+    def can_sign(self) -> bool:
+        return True
+
+    def sign(self, data: bytes) -> str:
+        return hmac.new(self.secret, data, hashlib.sha256).hexdigest()
+
+    def verify(self, data: bytes, signature: str) -> bool:
+        return hmac.compare_digest(self.sign(data), signature)
+
+
+class Ed25519Key:
+    """Ed25519 key pair; nodes without the private key can only verify"""
+
+    def __init__(self, public_key: bytes, private_key: Optional[bytes] = None):
+        try:
+            from cryptography.exceptions import InvalidSignature
+            from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+                Ed25519PrivateKey, Ed25519PublicKey
+            )
+        except ImportError as e:
+            raise RuntimeError(
+                'Ed25519 authority keys require the "cryptography" package'
+            ) from e
+
+        self._invalid_signature = InvalidSignature
+        self._public_key = Ed25519PublicKey.from_public_bytes(public_key)
+        self._private_key = Ed25519PrivateKey.from_private_bytes(private_key) if private_key else None
+
+    @property
+    def can_sign(self) -> bool:
+        return self._private_key is not None
+
+    def sign(self, data: bytes) -> str:
+        if self._private_key is None:
+            raise RuntimeError('No private key configured for this authority')
+        return self._private_key.sign(data).hex()
+
+    def verify(self, data: bytes, signature: str) -> bool:
+        try:
+            self._public_key.verify(bytes.fromhex(signature), data)
+            return True
+        except (ValueError, self._invalid_signature):
+            return False
+
+
+class AuthorityConsensus(Consensus):
+    name = 'authority'
+
+    def __init__(self, keys: Dict[str, object], signer: Optional[str] = None):
+        if signer is not None and signer not in keys:
+            raise ValueError(f'Signer {signer!r} is not one of the configured authorities')
+        self.keys = keys
+        self.signer = signer
+
+    @property
+    def can_seal(self) -> bool:
+        return self.signer is not None and self.keys[self.signer].can_sign
+
+    def seal(self, block) -> None:
+        if not self.can_seal:
+            raise RuntimeError('This node is not configured to seal blocks')
+        block.signer = self.signer
+        block.signature = self.keys[self.signer].sign(block.hash.encode())
+
+    def verify(self, block) -> bool:
+        key = self.keys.get(block.signer)
+        if key is None or not block.signature:
+            return False
+        return key.verify(block.hash.encode(), block.signature)
+
+
+def _parse_keys(value: str) -> Dict[str, bytes]:
+    """Parse "id:hex,id:hex" into a mapping of authority id to key bytes"""
+    keys = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        authority_id, _, hex_key = item.partition(':')
+        if not hex_key:
+            raise ValueError(f'Authority key {item!r} must look like "id:hexkey"')
+        keys[authority_id] = bytes.fromhex(hex_key)
+    return keys
+
+
+def consensus_from_env(environ=os.environ) -> Consensus:
+    """Build the consensus configured through LEDGER_* environment variables"""
+    kind = environ.get('LEDGER_CONSENSUS', 'pow')
+    if kind == 'pow':
+        return ProofOfWork(int(environ.get('LEDGER_DIFFICULTY', '4')))
+    if kind != 'authority':
+        raise ValueError(f'Unknown consensus {kind!r}')
+
+    scheme = environ.get('LEDGER_AUTHORITY_SCHEME', 'hmac')
+    raw_keys = _parse_keys(environ.get('LEDGER_AUTHORITY_KEYS', ''))
+    if not raw_keys:
+        raise ValueError('LEDGER_AUTHORITY_KEYS must list at least one authority')
+    signer = environ.get('LEDGER_AUTHORITY_SIGNER') or None
+
+    if scheme == 'hmac':
+        keys = {authority_id: HmacKey(key) for authority_id, key in raw_keys.items()}
+    elif scheme == 'ed25519':
+        signing_key = environ.get('LEDGER_AUTHORITY_SIGNING_KEY')
+        keys = {
+            authority_id: Ed25519Key(
+                key,
+                bytes.fromhex(signing_key) if signing_key and authority_id == signer else None
+            )
+            for authority_id, key in raw_keys.items()
+        }
+    else:
+        raise ValueError(f'Unknown authority scheme {scheme!r}')
+    return AuthorityConsensus(keys, signer)
@@ -1,8 +1,9 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from app import app, db
+from app import create_app, db
 
 def migrate_database():
+    app = create_app()
     with app.app_context():
         # Drop existing tables (CAUTION: This will delete all existing data)
         db.drop_all()
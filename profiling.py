@@ -0,0 +1,89 @@
+"""Opt-in sampling profiler for individual Flask requests.
+
+When PROFILING_ENABLED is set on the app, a request carrying the
+`X-Profile: 1` header (or a `_profile=1` query argument) is sampled by a
+background thread. The collapsed stacks are written to PROFILE_DIR in the
+folded format understood by flamegraph.pl and speedscope, and the file path
+is returned in the `X-Profile-Path` response header.
+"""
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from flask import Flask, g, request
+
+
+class SamplingProfiler:
+    """Periodically samples the stack of a single thread"""
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self) -> str:
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+
+def _profiling_requested() -> bool:
+    return request.headers.get('X-Profile') == '1' or request.args.get('_profile') == '1'
+
+
+def install_profiler(app: Flask) -> None:
+    """Register the per-request profiling hooks; inactive unless PROFILING_ENABLED"""
+    app.config.setdefault('PROFILING_ENABLED', os.environ.get('PROFILING_ENABLED') == '1')
+    app.config.setdefault('PROFILE_DIR', os.environ.get('PROFILE_DIR', 'profiles'))
+    app.config.setdefault('PROFILE_INTERVAL', float(os.environ.get('PROFILE_INTERVAL', '0.001')))
+
+    @app.before_request
+    def _start_profiler():
+        if app.config['PROFILING_ENABLED'] and _profiling_requested():
+            profiler = SamplingProfiler(threading.get_ident(), app.config['PROFILE_INTERVAL'])
+            profiler.start()
+            g._profiler = profiler
+
+    @app.after_request
+    def _write_profile(response):
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return response
+        profiler.stop()
+
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        endpoint = (request.endpoint or 'unmatched').replace('.', '_')
+        filename = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{endpoint}.folded"
+        path = os.path.join(app.config['PROFILE_DIR'], filename)
+        with open(path, 'w') as f:
+            f.write(profiler.folded())
+
+        response.headers['X-Profile-Path'] = path
+        response.headers['X-Profile-Samples'] = str(profiler.sample_count)
+        return response
@@ -0,0 +1,324 @@
+"""Incremental reconciliation between the database and the ledger.
+
+app.py commits each Product, TransportTracking and PharmacyInventory row
+first and then submits a matching transaction to the blockchain server. If
+that call fails, the two stores drift apart. Each run of this job reads only
+what changed since the last run: blocks above the checkpointed height and
+rows above the last checkpointed id in each table. It matches them by
+(transaction type, batch_id). Rows without a matching chain transaction
+after a grace period are reported, and with --resubmit they are sent to the
+chain again.
+
+The checkpoint file also keeps the unmatched rows and chain transactions,
+so the cost of a run grows with the changes since the last run plus the
+outstanding discrepancies, not with the size of either store. If the chain
+was replaced (a fork, or a server restart with an empty chain), the stored
+tip no longer matches and the next run starts from scratch. The same
+happens when the database was recreated (for example by migrate_db.py): ids
+restart at 1, so the last row read from each table is kept in the
+checkpoint and must still be there, unchanged.
+
+    python reconcile.py --interval 60 --resubmit
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from app import create_app, db, Product, TransportTracking, PharmacyInventory
+
+# Checkpointed tables, the chain transaction each row produces, and the
+# columns giving (row id, batch id, time of the write)
+SOURCES = {
+    'product': ('product_creation', lambda: db.session.query(
+        Product.id, Product.batch_id, Product.created_at)),
+    'transport_tracking': ('status_update', lambda: db.session.query(
+        TransportTracking.id, Product.batch_id, TransportTracking.updated_at
+    ).join(Product, Product.id == TransportTracking.product_id)),
+    'pharmacy_inventory': ('inventory_update', lambda: db.session.query(
+        PharmacyInventory.id, PharmacyInventory.batch_id, PharmacyInventory.updated_at)),
+}
+MODELS = {'product': Product, 'transport_tracking': TransportTracking, 'pharmacy_inventory': PharmacyInventory}
+TRACKED_TYPES = {tx_type for tx_type, _ in SOURCES.values()}
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    # The models store naive UTC datetimes
+    return None if value is None else value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _isoformat(value) -> Optional[str]:
+    return None if value is None else value.isoformat()
+
+
+def build_transaction(table: str, row, batch_id: str) -> Dict[str, Any]:
+    """Rebuild the transaction app.py would have submitted for a row"""
+    if table == 'product':
+        transaction = {'type': 'product_creation', 'product_data': {
+            'name': row.name,
+            'product_id': row.product_id,
+            'manufacturer_id': row.manufacturer_id,
+            'distributor_id': row.distributor_id,
+            'description': row.description,
+            'medicine_type': row.medicine_type,
+            'medicine_form': row.medicine_form,
+            'expiration_date': _isoformat(row.expiration_date),
+            'manufacturing_date': _isoformat(row.manufacturing_date),
+            'dosage': row.dosage,
+            'side_effects': row.side_effects,
+            'storage_conditions': row.storage_conditions,
+            'price': row.price,
+            'quantity': row.quantity,
+            'created_at': _isoformat(row.created_at),
+        }}
+        event_time = row.created_at
+    elif table == 'transport_tracking':
+        transaction = {'type': 'status_update', 'status': row.tracking_status, 'updated_by': row.updated_by,
+                       'product_data': {
+            'product_id': row.product_id,
+            'status': row.tracking_status,
+            'current_location': row.current_location,
+            'temperature': row.temperature,
+            'humidity': row.humidity,
+            'transport_conditions': row.transport_conditions,
+            'expected_delivery_date': _isoformat(row.expected_delivery_date),
+            'carrier': row.carrier,
+            'tracking_number': row.tracking_number,
+            'notes': row.notes,
+        }}
+        event_time = row.updated_at
+    else:
+        transaction = {'type': 'inventory_update', 'status': row.status, 'updated_by': row.updated_by,
+                       'product_data': {
+            'product_id': row.product_id,
+            'status': row.status,
+            'quantity': row.quantity,
+            'unit_price': row.unit_price,
+        }}
+        event_time = row.updated_at
+
+    transaction['batch_id'] = batch_id
+    transaction['timestamp'] = _timestamp(event_time) or time.time()
+    transaction['reconciled'] = True  # Submitted after the fact by this job
+    return transaction
+
+
+class ChainReplaced(Exception):
+    pass
+
+
+class DatabaseReset(Exception):
+    pass
+
+
+class Reconciler:
+    def __init__(self, checkpoint_path: str, chain_url: str, grace: float = 120.0,
+                 page_size: int = 1000, timeout: float = 10.0):
+        self.checkpoint_path = checkpoint_path
+        self.chain_url = chain_url.rstrip('/')
+        self.grace = grace
+        self.page_size = page_size
+        self.timeout = timeout
+        self.state = self.load_checkpoint()
+
+    @staticmethod
+    def empty_state() -> Dict[str, Any]:
+        return {
+            'chain_height': 0,
+            'tip_hash': None,
+            'last_ids': {table: 0 for table in SOURCES},
+            # Last row read from each table: [id, batch_id, write time]
+            'markers': {},
+            # Rows not yet seen on the chain:
+            # {"table", "id", "type", "batch_id", "time", "resubmitted"}
+            'pending': [],
+            # Chain transactions not yet matched to a row: {"type\tbatch_id": count}
+            'unmatched_chain': {},
+        }
+
+    def load_checkpoint(self) -> Dict[str, Any]:
+        if not os.path.exists(self.checkpoint_path):
+            return self.empty_state()
+        with open(self.checkpoint_path) as f:
+            return {**self.empty_state(), **json.load(f)}
+
+    def save_checkpoint(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f'{self.checkpoint_path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(temporary, self.checkpoint_path)
+
+    def _fetch_blocks(self, from_height: int) -> Dict[str, Any]:
+        response = requests.get(
+            f'{self.chain_url}/blocks',
+            params={'from_height': from_height, 'limit': self.page_size},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def scan_chain(self) -> int:
+        """Count new chain transactions of the tracked types; returns blocks read"""
+        state = self.state
+        unmatched = state['unmatched_chain']
+        scanned = 0
+        while True:
+            height = state['chain_height']
+            # Re-read the checkpointed tip to notice a replaced chain
+            start = max(height - 1, 0)
+            page = self._fetch_blocks(start)
+            blocks = page['blocks']
+            if height and (not blocks or blocks[0]['hash'] != state['tip_hash']):
+                raise ChainReplaced(f"Block {height - 1} is no longer {state['tip_hash']}")
+            new_blocks = blocks[height - start:]
+            for block in new_blocks:
+                for tx in block['transactions']:
+                    if tx.get('type') in TRACKED_TYPES and tx.get('batch_id') is not None:
+                        key = f"{tx['type']}\t{tx['batch_id']}"
+                        unmatched[key] = unmatched.get(key, 0) + 1
+            if new_blocks:
+                state['chain_height'] = new_blocks[-1]['index'] + 1
+                state['tip_hash'] = new_blocks[-1]['hash']
+                scanned += len(new_blocks)
+            if not new_blocks or state['chain_height'] >= page['height']:
+                return scanned
+
+    def check_tables(self) -> None:
+        """Raise DatabaseReset if the last row read from a table is gone or changed"""
+        state = self.state
+        for table, (_, query) in SOURCES.items():
+            last_id = state['last_ids'][table]
+            if not last_id:
+                continue
+            model = MODELS[table]
+            row = query().filter(model.id == last_id).first()
+            current = None if row is None else [row[0], row[1], _timestamp(row[2])]
+            marker = state['markers'].get(table)
+            if current is None or (marker is not None and current != marker):
+                raise DatabaseReset(f'{table} row {last_id} is no longer the row read last time')
+            # Checkpoints written before markers existed get one now
+            state['markers'][table] = current
+
+    def scan_tables(self) -> Dict[str, int]:
+        """Queue rows added since the last run; returns rows read per table"""
+        state = self.state
+        counts = {}
+        for table, (tx_type, query) in SOURCES.items():
+            counts[table] = 0
+            model = MODELS[table]
+            while True:
+                rows = query().filter(model.id > state['last_ids'][table]).order_by(model.id).limit(self.page_size).all()
+                for row_id, batch_id, written_at in rows:
+                    state['pending'].append({
+                        'table': table, 'id': row_id, 'type': tx_type, 'batch_id': batch_id,
+                        'time': _timestamp(written_at) or time.time(), 'resubmitted': False,
+                    })
+                if rows:
+                    state['last_ids'][table] = rows[-1][0]
+                    state['markers'][table] = [rows[-1][0], rows[-1][1], _timestamp(rows[-1][2])]
+                    counts[table] += len(rows)
+                if len(rows) < self.page_size:
+                    break
+        return counts
+
+    def match(self) -> int:
+        """Pair pending rows with unmatched chain transactions, oldest rows first"""
+        unmatched = self.state['unmatched_chain']
+        still_pending = []
+        matched = 0
+        for event in self.state['pending']:
+            key = f"{event['type']}\t{event['batch_id']}"
+            if unmatched.get(key):
+                unmatched[key] -= 1
+                if not unmatched[key]:
+                    del unmatched[key]
+                matched += 1
+            else:
+                still_pending.append(event)
+        self.state['pending'] = still_pending
+        return matched
+
+    def resubmit(self, event: Dict[str, Any]) -> bool:
+        row = db.session.get(MODELS[event['table']], event['id'])
+        if row is None:
+            return False
+        transaction = build_transaction(event['table'], row, event['batch_id'])
+        try:
+            response = requests.post(f'{self.chain_url}/add_transaction', json=transaction, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            return False
+        return response.status_code == 200
+
+    def run_once(self, resubmit: bool = False) -> Dict[str, Any]:
+        started = time.time()
+        summary: Dict[str, Any] = {'reset': False}
+        try:
+            self.check_tables()
+            summary['blocks_scanned'] = self.scan_chain()
+        except (ChainReplaced, DatabaseReset) as e:
+            # Everything already matched may now be missing; start over
+            self.state = self.empty_state()
+            summary['reset'] = True
+            summary['reset_reason'] = str(e)
+            summary['blocks_scanned'] = self.scan_chain()
+        summary['rows_scanned'] = self.scan_tables()
+        summary['matched'] = self.match()
+
+        missing: List[Dict[str, Any]] = []
+        resubmitted = 0
+        for event in self.state['pending']:
+            # Rows inside the grace window may still have their chain write in flight
+            if event['resubmitted'] or started - event['time'] < self.grace:
+                continue
+            if resubmit and self.resubmit(event):
+                # Keep it pending so the resubmitted transaction matches it later
+                event['resubmitted'] = True
+                resubmitted += 1
+            else:
+                missing.append(event)
+        summary['missing'] = missing
+        summary['resubmitted'] = resubmitted
+        summary['pending'] = len(self.state['pending'])
+        summary['chain_height'] = self.state['chain_height']
+        summary['seconds'] = time.time() - started
+        self.save_checkpoint()
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile database rows with ledger transactions')
+    parser.add_argument('--checkpoint', help='defaults to instance/reconcile_checkpoint.json')
+    parser.add_argument('--chain-url', help='defaults to the app\'s BLOCKCHAIN_SERVER_URL')
+    parser.add_argument('--grace', type=float, default=120.0,
+                        help='seconds before an unmatched row counts as missing')
+    parser.add_argument('--resubmit', action='store_true', help='send missing events to the chain again')
+    parser.add_argument('--interval', type=float, default=0,
+                        help='run every N seconds; 0 runs once')
+    args = parser.parse_args()
+
+    app = create_app()
+    checkpoint = args.checkpoint or os.path.join(app.instance_path, 'reconcile_checkpoint.json')
+    with app.app_context():
+        reconciler = Reconciler(checkpoint, args.chain_url or app.config['BLOCKCHAIN_SERVER_URL'], args.grace)
+        while True:
+            try:
+                summary = reconciler.run_once(args.resubmit)
+            except requests.exceptions.RequestException as e:
+                # The checkpoint is untouched, so the next run retries the same delta
+                summary = {'error': f'Blockchain server unreachable: {e}'}
+                reconciler.state = reconciler.load_checkpoint()
+            db.session.remove()
+            print(json.dumps(summary, default=str))
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Pull-based replication between blockchain server nodes.
+
+Each node keeps a set of peer base URLs. A sync asks every peer for the
+blocks above the local height. New blocks that extend the local tip are
+validated and appended. If a peer's blocks do not link to the local tip,
+the two chains have forked: the node downloads the peer's full chain and
+adopts it only if it is longer and valid (longest valid chain wins).
+"""
+import logging
+import threading
+from typing import Dict, List, Set
+
+import requests
+
+from blockchain import Block, Blockchain
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SYNC_BLOCKS = REGISTRY.counter(
+    'ledger_sync_blocks_total', 'Blocks appended from peers by incremental sync'
+)
+SYNC_REPLACEMENTS = REGISTRY.counter(
+    'ledger_sync_chain_replacements_total', 'Times a longer peer chain replaced the local chain'
+)
+SYNC_ERRORS = REGISTRY.counter(
+    'ledger_sync_errors_total', 'Failed sync attempts per peer', ('peer',)
+)
+
+
+class PeerSync:
+    def __init__(self, blockchain: Blockchain, peers: List[str] = (), page_size: int = 500,
+                 timeout: float = 5.0):
+        self.blockchain = blockchain
+        self.peers: Set[str] = set()
+        self.page_size = page_size
+        self.timeout = timeout
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        for peer in peers:
+            self.register(peer)
+
+    def register(self, address: str) -> str:
+        address = address.rstrip('/')
+        if not address.startswith(('http://', 'https://')):
+            address = f'http://{address}'
+        self.peers.add(address)
+        return address
+
+    def _fetch_blocks(self, peer: str, from_height: int) -> Dict:
+        response = requests.get(
+            f'{peer}/blocks',
+            params={'from_height': from_height, 'limit': self.page_size},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _fetch_chain(self, peer: str) -> List[Block]:
+        """Download every block a peer has, page by page"""
+        blocks: List[Block] = []
+        while True:
+            page = self._fetch_blocks(peer, len(blocks))
+            blocks.extend(Block.from_dict(data) for data in page['blocks'])
+            if not page['blocks'] or len(blocks) >= page['height']:
+                return blocks
+
+    def sync_with_peer(self, peer: str) -> Dict[str, int]:
+        """Pull new blocks from one peer"""
+        result = {'appended': 0, 'replaced': 0}
+        while True:
+            snapshot = self.blockchain.snapshot()
+            height, tip = snapshot.height, snapshot.tip
+            page = self._fetch_blocks(peer, height)
+            if not isinstance(page, dict) or not isinstance(page.get('blocks'), list):
+                raise ValueError(f'Peer {peer} sent a malformed /blocks page')
+            if page['height'] <= height or not page['blocks']:
+                return result
+
+            blocks = [Block.from_dict(data) for data in page['blocks']]
+            if blocks[0].previous_hash == tip.hash:
+                if not self.blockchain.append_blocks(blocks):
+                    if self.blockchain.snapshot().tip is not tip:
+                        continue  # A local block landed first; compare again
+                    raise ValueError(f'Peer {peer} sent invalid blocks above height {height}')
+                result['appended'] += len(blocks)
+                SYNC_BLOCKS.inc(len(blocks))
+                continue
+
+            # The peer's chain diverges from ours somewhere below our tip
+            if self.blockchain.replace_chain(self._fetch_chain(peer)):
+                result['replaced'] += 1
+                SYNC_REPLACEMENTS.inc()
+            return result
+
+    def sync(self) -> Dict[str, object]:
+        """Pull from every peer; unreachable or misbehaving peers are skipped"""
+        summary = {'appended': 0, 'replaced': 0, 'errors': {}}
+        with self._sync_lock:
+            for peer in sorted(self.peers):
+                try:
+                    result = self.sync_with_peer(peer)
+                except Exception as e:
+                    # A peer can send anything; one bad page must not stop the others
+                    SYNC_ERRORS.inc(peer=peer)
+                    summary['errors'][peer] = f'{type(e).__name__}: {e}'
+                    logger.warning('Sync with %s failed: %s: %s', peer, type(e).__name__, e)
+                    continue
+                summary['appended'] += result['appended']
+                summary['replaced'] += result['replaced']
+        summary['height'] = self.blockchain.height
+        return summary
+
+    def start(self, interval: float) -> threading.Thread:
+        """Sync with all peers every interval seconds in a daemon thread"""
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.sync()
+                except Exception:
+                    # Keep replicating; the next round may succeed
+                    logger.exception('Peer sync round failed')
+
+        thread = threading.Thread(target=loop, name='peer-sync', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stop.set()
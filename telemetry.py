@@ -0,0 +1,221 @@
+"""Cold-chain telemetry: compact storage, downsampling and excursion detection.
+
+Sensor readings arrive in batches of (timestamp, temperature, humidity). A
+batch is kept as three float64 arrays, compressed into a single blob, and
+rolled up into fixed-interval min/max/avg aggregates for dashboards. Each
+batch is also checked against the limits parsed from the product's free-text
+`storage_conditions`.
+"""
+import math
+import re
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+METRICS = ('temperature', 'humidity')
+_HEADER = struct.Struct('<4sI')
+_MAGIC = b'TLM1'
+
+Limits = namedtuple('Limits', 'temperature_min temperature_max humidity_min humidity_max')
+Bucket = namedtuple('Bucket', 'start count minimum maximum total')
+Excursion = namedtuple('Excursion', 'metric start end count peak limit')
+
+_NUMBER = r'(-?\d+(?:\.\d+)?)'
+_RANGE = re.compile(_NUMBER + r'\s*°?\s*[CF%]?\s*(?:-|–|to|and)\s*' + _NUMBER)
+_UPPER = re.compile(r'(?:below|under|less than|not (?:above|exceeding|exceed|more than)|up to|max(?:imum)?|<=?)\s*' + _NUMBER)
+_LOWER = re.compile(r'(?:above|over|more than|at least|not below|min(?:imum)?|>=?)\s*' + _NUMBER)
+
+
+class TelemetryError(ValueError):
+    pass
+
+
+class TelemetryBatch:
+    """Readings for one product, sorted by time and stored as float arrays"""
+
+    def __init__(self, timestamps: Iterable[float], temperature: Iterable[float],
+                 humidity: Iterable[float]):
+        self.timestamps = array('d', timestamps)
+        self.temperature = array('d', temperature)
+        self.humidity = array('d', humidity)
+        if not len(self.timestamps) == len(self.temperature) == len(self.humidity):
+            raise TelemetryError('timestamps, temperature and humidity must have the same length')
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_readings(cls, readings: List[Dict]) -> 'TelemetryBatch':
+        """Build a batch from [{"timestamp", "temperature", "humidity"}, ...]; missing values are NaN"""
+        rows = []
+        for position, reading in enumerate(readings):
+            try:
+                rows.append((
+                    _parse_timestamp(reading['timestamp']),
+                    _parse_value(reading.get('temperature')),
+                    _parse_value(reading.get('humidity')),
+                ))
+            except (KeyError, TypeError, ValueError) as e:
+                raise TelemetryError(f'Invalid reading at position {position}: {e}') from e
+        rows.sort(key=lambda row: row[0])
+        return cls((r[0] for r in rows), (r[1] for r in rows), (r[2] for r in rows))
+
+    def values(self, metric: str) -> array:
+        return getattr(self, metric)
+
+    def pack(self) -> bytes:
+        """Serialize to a compressed little-endian blob"""
+        columns = [array('d', column) for column in (self.timestamps, self.temperature, self.humidity)]
+        if sys.byteorder == 'big':
+            for column in columns:
+                column.byteswap()
+        body = b''.join(column.tobytes() for column in columns)
+        return _HEADER.pack(_MAGIC, len(self)) + zlib.compress(body)
+
+    @classmethod
+    def unpack(cls, blob: bytes) -> 'TelemetryBatch':
+        magic, count = _HEADER.unpack_from(blob)
+        if magic != _MAGIC:
+            raise TelemetryError('Not a telemetry blob')
+        body = zlib.decompress(blob[_HEADER.size:])
+        columns = []
+        for i in range(3):
+            column = array('d')
+            column.frombytes(body[i * count * 8:(i + 1) * count * 8])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns.append(column)
+        return cls(*columns)
+
+
+def _finite(value: float) -> float:
+    # json.loads accepts NaN and Infinity; NaN is reserved for missing values
+    if not math.isfinite(value):
+        raise TelemetryError(f'{value} is not a finite number')
+    return value
+
+
+def _parse_timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return _finite(float(value))
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+
+
+def _parse_value(value) -> float:
+    if value is None or value == '':
+        return math.nan
+    return _finite(float(value))
+
+
+def parse_storage_conditions(text: Optional[str]) -> Limits:
+    """Extract temperature (°C) and humidity (%) limits from free text.
+
+    Understands forms such as "2-8°C", "Store below 25°C", "between 15 and
+    30 C, humidity below 60%" and "RH < 65%". Unknown bounds are None.
+    """
+    bounds = {'temperature': [None, None], 'humidity': [None, None]}
+    if not text:
+        return Limits(None, None, None, None)
+
+    for clause in re.split(r'[,;.\n]+(?!\d)', text.lower()):
+        metric = 'humidity' if ('%' in clause or 'humid' in clause or 'rh' in clause.split()) else 'temperature'
+        fahrenheit = metric == 'temperature' and re.search(r'°\s*f\b|\d\s*f\b|fahrenheit', clause)
+
+        def convert(value: str) -> float:
+            number = float(value)
+            return (number - 32) * 5 / 9 if fahrenheit else number
+
+        match = _RANGE.search(clause)
+        if match:
+            low, high = sorted((convert(match.group(1)), convert(match.group(2))))
+            bounds[metric] = [low, high]
+            continue
+        match = _UPPER.search(clause)
+        if match:
+            bounds[metric][1] = convert(match.group(1))
+        match = _LOWER.search(clause)
+        if match:
+            bounds[metric][0] = convert(match.group(1))
+
+    return Limits(bounds['temperature'][0], bounds['temperature'][1],
+                  bounds['humidity'][0], bounds['humidity'][1])
+
+
+def downsample(timestamps: array, values: array, interval: float) -> List[Bucket]:
+    """Min/max/sum per fixed interval, skipping missing (NaN) values"""
+    buckets: List[Bucket] = []
+    current = None
+    count = 0
+    minimum = maximum = total = 0.0
+    for timestamp, value in zip(timestamps, values):
+        if value != value:  # NaN
+            continue
+        start = float(math.floor(timestamp / interval) * interval)
+        if start != current:
+            if count:
+                buckets.append(Bucket(current, count, minimum, maximum, total))
+            current, count, minimum, maximum, total = start, 0, value, value, 0.0
+        count += 1
+        total += value
+        if value < minimum:
+            minimum = value
+        elif value > maximum:
+            maximum = value
+    if count:
+        buckets.append(Bucket(current, count, minimum, maximum, total))
+    return buckets
+
+
+def detect_excursions(batch: TelemetryBatch, limits: Limits) -> List[Excursion]:
+    """Contiguous runs of readings outside the limits, one entry per run"""
+    excursions: List[Excursion] = []
+    for metric in METRICS:
+        low = getattr(limits, f'{metric}_min')
+        high = getattr(limits, f'{metric}_max')
+        if low is None and high is None:
+            continue
+
+        run = None  # [start, end, count, peak, limit]
+        for timestamp, value in zip(batch.timestamps, batch.values(metric)):
+            if value != value:
+                continue
+            if high is not None and value > high:
+                breached, limit = True, high
+            elif low is not None and value < low:
+                breached, limit = True, low
+            else:
+                breached = False
+
+            if breached:
+                if run is None or run[4] != limit:
+                    if run is not None:
+                        excursions.append(Excursion(metric, *run))
+                    run = [timestamp, timestamp, 0, value, limit]
+                run[1] = timestamp
+                run[2] += 1
+                if abs(value - limit) > abs(run[3] - limit):
+                    run[3] = value
+            elif run is not None:
+                excursions.append(Excursion(metric, *run))
+                run = None
+        if run is not None:
+            excursions.append(Excursion(metric, *run))
+    return excursions
+
+
+def summarize(batch: TelemetryBatch) -> Dict[str, Optional[Dict[str, float]]]:
+    """Count and min/max/avg per metric for a whole batch"""
+    summary = {}
+    for metric in METRICS:
+        values = [v for v in batch.values(metric) if v == v]
+        summary[metric] = {
+            'count': len(values),
+            'min': min(values),
+            'max': max(values),
+            'avg': sum(values) / len(values),
+        } if values else None
+    return summary
@@ -0,0 +1,77 @@
+"""In-process cache of users and role membership for request handling.
+
+Flask-Login resolves the session's user on every authenticated request,
+and the dashboards list every distributor or pharmacy for their dropdowns.
+These rows rarely change, so UserDirectory keeps immutable copies of them
+for a TTL. Writes through the app (register, login, profile updates) call
+invalidate() so that this process sees them at once. Other worker
+processes pick them up when their entries expire.
+"""
+import threading
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import REGISTRY
+
+DIRECTORY_LOOKUPS = REGISTRY.counter(
+    'user_directory_lookups_total', 'User directory cache lookups', ('kind', 'outcome')
+)
+
+
+class UserDirectory:
+    """TTL cache in front of two loaders: one user by id, and all users of a role.
+
+    Loaders must return values that are safe to share between threads
+    (for example namedtuples), or None for a missing user.
+    """
+
+    def __init__(self, load_user: Callable[[int], Any], load_role: Callable[[str], Tuple],
+                 ttl: float = 60.0, clock: Callable[[], float] = monotonic):
+        self._loaders = {'user': load_user, 'role': load_role}
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: Dict[Tuple[str, Hashable], Tuple[float, Any]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, kind: str, key: Hashable) -> Any:
+        now = self._clock()
+        entry = self._entries.get((kind, key))
+        if entry is not None and entry[0] > now:
+            DIRECTORY_LOOKUPS.inc(kind=kind, outcome='hit')
+            return entry[1]
+
+        DIRECTORY_LOOKUPS.inc(kind=kind, outcome='miss')
+        generation = self._generation
+        value = self._loaders[kind](key)
+        with self._lock:
+            # Skip the store if an invalidation ran while we were loading,
+            # since the value may predate the write that caused it
+            if self.ttl > 0 and generation == self._generation:
+                self._entries[(kind, key)] = (now + self.ttl, value)
+        return value
+
+    def get(self, user_id: int) -> Optional[Any]:
+        return self._lookup('user', int(user_id))
+
+    def role_members(self, role: str) -> Tuple:
+        """All users with a role, ordered by id"""
+        return self._lookup('role', role)
+
+    def first_in_role(self, role: str) -> Optional[Any]:
+        members = self.role_members(role)
+        return members[0] if members else None
+
+    def invalidate(self, user_id: int = None, role: str = None) -> None:
+        """Drop the cached entries for a user and/or a role after a write"""
+        with self._lock:
+            self._generation += 1
+            if user_id is not None:
+                self._entries.pop(('user', int(user_id)), None)
+            if role is not None:
+                self._entries.pop(('role', role), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()